@@ -0,0 +1,294 @@
+"""
+api.py – Local HTTP API (plain ASGI) for extraction and rendering.
+
+    uvicorn api:app --port 8000
+
+    POST /extract                       PDF body            -> estimate JSON
+         Accept: application/x-rapido-estimate              -> binary estimate (rapido/estimate_codec.py)
+    POST /render                        JSON body           -> PDF
+         {"estimate": {...}, "template_id": "...", "show_branding": true}
+    POST /render?template_id=...        binary estimate     -> PDF
+         Content-Type: application/x-rapido-estimate, optional: &show_branding=0
+    POST /process?template_id=...       PDF body            -> PDF (extract + render)
+         optional: &show_branding=0
+    GET  /health                                            -> {"status": "ok", ...}
+
+CPU-bound work runs in a process pool behind the async front end. Requests
+beyond max_in_flight get 503, bodies beyond max_body_bytes get 413.
+Templates come from SUPABASE_URL/SUPABASE_KEY, or from a local JSON file
+(RAPIDO_TEMPLATES_JSON) as a stand-in for the template store.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs
+
+from rapido import estimate_codec
+from rapido.render_cache import RenderCache, render_key
+from rapido.rendering import template_config
+from rapido.template_store import InMemoryTemplateStore, SupabaseTemplateStore
+
+CHUNK_SIZE = 64 * 1024
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = list(headers)
+
+
+# --- Travail CPU (exécuté dans les process workers) ---
+def _extract_bytes(raw):
+    from rapido.cas import extract_cached
+    return extract_cached(raw)
+
+
+def _render(data, config):
+    """(pdf_bytes, cacheable): a render whose logo could not be fetched is not kept in the render cache."""
+    from rapido.assets import logo_missing
+    from rapido.cas import render_cached
+    cacheable = not logo_missing(config)
+    return render_cached(data, config), cacheable
+
+
+def _extract_and_render(raw, config):
+    data = _extract_bytes(raw)
+    return (data, *_render(data, config))
+
+
+def _flag(value, name):
+    """Boolean parameter: JSON bool or 0/1, "1"/"0", "true"/"false", "yes"/"no", "on"/"off". HTTPError 400 otherwise."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in ("1", "true", "yes", "on"):
+            return True
+        if text in ("0", "false", "no", "off"):
+            return False
+    raise HTTPError(400, f"{name} must be a boolean")
+
+
+def _header(scope, name):
+    for key, value in scope.get("headers") or []:
+        if key.lower() == name:
+            return value.decode("latin-1").lower()
+    return ""
+
+
+class RapidoAPI:
+    def __init__(self, template_store, executor=None, max_workers=None, max_in_flight=8,
+                 max_body_bytes=20 * 1024 * 1024, render_cache=None):
+        self.template_store = template_store
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.max_in_flight = max_in_flight
+        self.max_body_bytes = max_body_bytes
+        self.render_cache = render_cache or RenderCache(max_entries=64)
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._in_flight = 0
+        self._routes = {
+            ("GET", "/health"): self.health,
+            ("POST", "/extract"): self.extract,
+            ("POST", "/render"): self.render,
+            ("POST", "/process"): self.process,
+        }
+
+    @property
+    def executor(self):
+        # Pool créé au premier appel : l'import du module reste léger
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    # --- ASGI ---
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        try:
+            handler = self._routes.get((scope["method"], scope["path"]))
+            if handler is None:
+                raise HTTPError(404, "Not found")
+            if handler == self.health:
+                await handler(scope, receive, send)
+                return
+            if self._in_flight >= self.max_in_flight:
+                raise HTTPError(503, "Server busy, retry later", [(b"retry-after", b"2")])
+            self._in_flight += 1
+            try:
+                await handler(scope, receive, send)
+            finally:
+                self._in_flight -= 1
+        except HTTPError as e:
+            await self._send_json(send, e.status, {"error": e.message}, e.headers)
+        except Exception as e:
+            await self._send_json(send, 500, {"error": f"{type(e).__name__}: {e}"})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._owns_executor and self._executor is not None:
+                    self._executor.shutdown(wait=False, cancel_futures=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # --- Helpers I/O ---
+    async def _read_body(self, scope, receive):
+        headers = dict(scope.get("headers") or [])
+        declared = headers.get(b"content-length")
+        if declared and not declared.strip().isdigit():
+            raise HTTPError(400, "Invalid Content-Length header")
+        if declared and int(declared) > self.max_body_bytes:
+            raise HTTPError(413, f"Body larger than {self.max_body_bytes} bytes")
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise HTTPError(400, "Client disconnected")
+            body = message.get("body", b"")
+            size += len(body)
+            if size > self.max_body_bytes:
+                raise HTTPError(413, f"Body larger than {self.max_body_bytes} bytes")
+            chunks.append(body)
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    async def _read_pdf(self, scope, receive):
+        raw = await self._read_body(scope, receive)
+        if not raw.startswith(b"%PDF"):
+            raise HTTPError(415, "Expected a PDF body")
+        return raw
+
+    async def _send_bytes(self, send, status, body, content_type, headers=()):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type.encode()),
+                        (b"content-length", str(len(body)).encode())] + list(headers),
+        })
+        # Réponse envoyée par morceaux : pas de second gros buffer côté serveur ASGI
+        offset = 0
+        while True:
+            chunk = body[offset:offset + CHUNK_SIZE]
+            offset += CHUNK_SIZE
+            more = offset < len(body)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more})
+            if not more:
+                return
+
+    async def _send_json(self, send, status, payload, headers=()):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await self._send_bytes(send, status, body, "application/json; charset=utf-8", headers)
+
+    async def _send_estimate(self, send, scope, data):
+        # Format binaire si le client le demande, JSON sinon
+        if estimate_codec.MEDIA_TYPE in _header(scope, b"accept"):
+            await self._send_bytes(send, 200, estimate_codec.encode(data), estimate_codec.MEDIA_TYPE)
+        else:
+            await self._send_json(send, 200, data)
+
+    async def _send_pdf(self, send, pdf_bytes, data):
+        filename = f"Estimation_{data.get('numero_devis', 'Inconnu')}.pdf"
+        await self._send_bytes(send, 200, pdf_bytes, "application/pdf",
+                               [(b"content-disposition", f'attachment; filename="{filename}"'.encode())])
+
+    async def _config_for(self, template_id, show_branding):
+        if not template_id:
+            raise HTTPError(400, "template_id is required")
+        # Store distant (Supabase, avec reprises) : appel bloquant, hors de la boucle d'événements
+        template = await asyncio.to_thread(self.template_store.get, template_id)
+        if template is None:
+            raise HTTPError(404, f"Unknown template {template_id}")
+        return template_config(template, show_branding)
+
+    async def _render_cached(self, data, config):
+        key = render_key(data, config)
+        pdf_bytes = self.render_cache.get(key)
+        if pdf_bytes is None:
+            pdf_bytes, cacheable = await self._run(_render, data, config)
+            if cacheable:
+                self.render_cache.put(key, pdf_bytes)
+        return pdf_bytes
+
+    # --- Endpoints ---
+    async def health(self, scope, receive, send):
+        await self._send_json(send, 200, {"status": "ok", "in_flight": self._in_flight,
+                                          "render_cache": self.render_cache.stats()})
+
+    async def extract(self, scope, receive, send):
+        raw = await self._read_pdf(scope, receive)
+        data = await self._run(_extract_bytes, raw)
+        await self._send_estimate(send, scope, data)
+
+    async def render(self, scope, receive, send):
+        raw = await self._read_body(scope, receive)
+        if _header(scope, b"content-type").startswith(estimate_codec.MEDIA_TYPE):
+            try:
+                # Décompression et décodage hors de la boucle d'événements
+                data = await self._run(estimate_codec.decode, raw)
+            except ValueError as e:
+                raise HTTPError(400, f"Invalid binary estimate: {e}")
+            if not isinstance(data, dict):
+                raise HTTPError(400, "Binary body must encode an estimate object")
+            query = parse_qs(scope.get("query_string", b"").decode())
+            show_branding = _flag(query.get("show_branding", ["1"])[0], "show_branding")
+            config = await self._config_for(query.get("template_id", [None])[0], show_branding)
+            pdf_bytes = await self._render_cached(data, config)
+            await self._send_pdf(send, pdf_bytes, data)
+            return
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            raise HTTPError(400, "Invalid JSON body")
+        if not isinstance(payload, dict) or not isinstance(payload.get("estimate"), dict):
+            raise HTTPError(400, "Body must be {\"estimate\": {...}, \"template_id\": ...}")
+        show_branding = _flag(payload.get("show_branding", True), "show_branding")
+        config = await self._config_for(payload.get("template_id"), show_branding)
+        pdf_bytes = await self._render_cached(payload["estimate"], config)
+        await self._send_pdf(send, pdf_bytes, payload["estimate"])
+
+    async def process(self, scope, receive, send):
+        query = parse_qs(scope.get("query_string", b"").decode())
+        show_branding = _flag(query.get("show_branding", ["1"])[0], "show_branding")
+        config = await self._config_for(query.get("template_id", [None])[0], show_branding)
+        raw = await self._read_pdf(scope, receive)
+        data, pdf_bytes, cacheable = await self._run(_extract_and_render, raw, config)
+        if cacheable:
+            self.render_cache.put(render_key(data, config), pdf_bytes)
+        await self._send_pdf(send, pdf_bytes, data)
+
+
+def create_app_from_env():
+    url, key = os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_KEY")
+    if url and key:
+        store = SupabaseTemplateStore(url, key)
+    else:
+        templates = []
+        path = os.environ.get("RAPIDO_TEMPLATES_JSON")
+        if path:
+            with open(path, encoding="utf-8") as f:
+                templates = json.load(f)
+        store = InMemoryTemplateStore(templates)
+    return RapidoAPI(
+        store,
+        max_in_flight=int(os.environ.get("RAPIDO_API_MAX_IN_FLIGHT", 8)),
+        max_body_bytes=int(os.environ.get("RAPIDO_API_MAX_BODY_BYTES", 20 * 1024 * 1024)),
+    )
+
+
+app = create_app_from_env()
@@ -1,92 +1,267 @@
 import streamlit as st
-from supabase import create_client, Client
 import mimetypes
+import os
+import logging
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from rapido import logos, mailer, tracing
+from rapido.mirror import LocalMirror
+from rapido.supabase_pool import SupabasePool
+
+logger = logging.getLogger(__name__)
+
+# Miroir local + mode hors-ligne (tests, démo) : aucune connexion réseau si RAPIDO_OFFLINE=1
+MIRROR_PATH = os.environ.get("RAPIDO_MIRROR_PATH", os.path.join(".rapido", "mirror.sqlite3"))
+OFFLINE = os.environ.get("RAPIDO_OFFLINE") == "1"
 
 # Singleton to avoid reconnecting on every rerun
 @st.cache_resource
+@tracing.traced()
 def init_supabase():
-    url = st.secrets["supabase"]["url"]
-    key = st.secrets["supabase"]["key"]
-    return create_client(url, key)
+    """Pool of Supabase clients: timeouts, retries for reads, latency histogram per table/operation."""
+    conf = st.secrets["supabase"]
+    return SupabasePool(
+        conf["url"],
+        conf["key"],
+        size=int(conf.get("pool_size", 4)),
+        timeout=float(conf.get("timeout", 10)),
+        retries=int(conf.get("retries", 2)),
+    )
 
+@tracing.traced()
+def latency_report():
+    """Latency summary per (table, operation) of the calls made to Supabase."""
+    return [] if OFFLINE else init_supabase().latency_report()
+
+@st.cache_resource
+@tracing.traced()
+def init_mirror():
+    """SQLite mirror serving every read; writes are synced to Supabase in the background."""
+    if MIRROR_PATH != ":memory:":
+        os.makedirs(os.path.dirname(MIRROR_PATH) or ".", exist_ok=True)
+    mirror = LocalMirror(MIRROR_PATH, remote=None if OFFLINE else init_supabase())
+    if not mirror.offline:
+        # Premier lancement : on remplit le miroir avant le premier affichage
+        try:
+            mirror.sync_once()
+        except Exception as e:
+            mirror.last_error = str(e)
+        mirror.start_sync()
+    return mirror
+
+@tracing.traced()
 def get_templates():
     """Fetch all templates ordered by creation date."""
-    supabase = init_supabase()
     try:
-        response = supabase.table("templates").select("*").order("created_at", desc=True).execute()
-        return response.data
+        return init_mirror().select("templates")
     except Exception as e:
         st.error(f"Erreur Supabase: {e}")
         return []
 
-def create_template(name, company_name, company_address, primary_color, logo_url=None):
+# Colonnes affichées par la galerie du dashboard (pas d'adresse ni d'emails)
+GALLERY_COLUMNS = "id,created_at,name,company_name,primary_color,logo_url,logo_thumb_url"
+
+@tracing.traced()
+def list_templates(limit=12, cursor=None, columns=GALLERY_COLUMNS):
+    """
+    One page of templates, newest first, with only the given columns.
+    Keyset pagination on (created_at, id): pass the returned cursor to get the next page.
+    Returns (rows, next_cursor) – next_cursor is None on the last page.
+    """
+    try:
+        cols = columns.split(",")
+        rows = init_mirror().select("templates", columns=cols, limit=limit + 1, cursor=cursor)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, (rows[-1]['created_at'], rows[-1]['id'])
+        return rows, None
+    except Exception as e:
+        st.error(f"Erreur Supabase: {e}")
+        return [], None
+
+@tracing.traced()
+def list_template_names():
+    """(id, name) of every template, for selectors."""
+    try:
+        return init_mirror().select("templates", columns=["id", "name"])
+    except Exception as e:
+        st.error(f"Erreur Supabase: {e}")
+        return []
+
+@tracing.traced()
+def get_template(template_id):
+    """Fetch one full template row (edit forms, rendering)."""
+    try:
+        return init_mirror().get("templates", template_id)
+    except Exception as e:
+        st.error(f"Erreur Supabase: {e}")
+        return None
+
+# Champs écrits par les formulaires (emails inclus : une seule requête)
+TEMPLATE_FIELDS = ("name", "company_name", "company_address", "primary_color",
+                   "logo_url", "logo_print_url", "logo_thumb_url", "emails")
+# Colonnes transportées par l'export / import en masse
+TEMPLATE_EXPORT_COLUMNS = ("id", "created_at", "is_default") + TEMPLATE_FIELDS
+
+@tracing.traced()
+def save_template(fields, template_id=None):
+    """
+    Create (template_id=None) or update a template with all its fields, emails included,
+    as a single write – the row is written entirely or not at all.
+    """
+    data = {k: fields[k] for k in TEMPLATE_FIELDS if k in fields}
+    try:
+        return [init_mirror().upsert("templates", data, template_id)]
+    except Exception as e:
+        st.error(f"Erreur Enregistrement: {e}")
+        return None
+
+@tracing.traced()
+def create_template(name, company_name, company_address, primary_color, logo_url=None, emails=None):
     """Insert a new template."""
-    supabase = init_supabase()
-    data = {
+    return save_template({
         "name": name,
         "company_name": company_name,
         "company_address": company_address,
         "primary_color": primary_color,
-        "logo_url": logo_url
-    }
-    try:
-        response = supabase.table("templates").insert(data).execute()
-        return response.data
-    except Exception as e:
-        st.error(f"Erreur Création: {e}")
-        return None
+        "logo_url": logo_url,
+        "emails": emails or []
+    })
 
+@tracing.traced()
 def update_template(template_id, name, company_name, company_address, primary_color, logo_url=None):
     """Update an existing template."""
-    supabase = init_supabase()
-    data = {
+    return save_template({
         "name": name,
         "company_name": company_name,
         "company_address": company_address,
         "primary_color": primary_color,
         "logo_url": logo_url
-    }
+    }, template_id)
+
+@tracing.traced()
+def export_templates():
+    """All templates (full rows) for moving them to another environment."""
     try:
-        response = supabase.table("templates").update(data).eq("id", template_id).execute()
-        return response.data
+        return init_mirror().select("templates", columns=list(TEMPLATE_EXPORT_COLUMNS), desc=False)
     except Exception as e:
-        st.error(f"Erreur Mise à jour: {e}")
-        return None
+        st.error(f"Erreur Export: {e}")
+        return []
 
+@tracing.traced()
+def import_templates(rows, chunk_size=500):
+    """
+    Bulk upsert of exported rows (matched on id), applied locally in one
+    transaction per chunk and synced as one batch. Returns the number of rows written.
+    """
+    keys = [k for k in TEMPLATE_EXPORT_COLUMNS if any(k in r for r in rows)]
+    normalised = [{k: r.get(k) for k in keys if r.get(k) is not None} for r in rows]
+    written = 0
+    try:
+        for i in range(0, len(normalised), chunk_size):
+            written += len(init_mirror().upsert_many("templates", normalised[i:i + chunk_size]))
+    except Exception as e:
+        st.error(f"Erreur Import (lignes {written + 1}+): {e}")
+    return written
+
+@tracing.traced()
 def delete_template(template_id):
     """Delete a template by ID."""
-    supabase = init_supabase()
     try:
-        response = supabase.table("templates").delete().eq("id", template_id).execute()
-        return response.data
+        return init_mirror().delete("templates", template_id)
     except Exception as e:
         st.error(f"Erreur Suppression: {e}")
         return None
 
-def upload_logo(file_obj, file_name):
-    """Uploads a file to 'logos' bucket and returns Public URL."""
-    supabase = init_supabase()
-    bucket_name = "logos"
-    
-    # Clean filename or use unique ID if needed (for now, use original)
-    # Ideally should imply uuid to avoid collision
-    import uuid
-    ext = file_name.split('.')[-1]
-    unique_name = f"{uuid.uuid4()}.{ext}"
-    
+@st.cache_resource
+@tracing.traced()
+def init_logo_storage():
+    if OFFLINE:
+        # Hors-ligne : les logos restent sur disque, le chemin local sert d'URL
+        return logos.LocalLogoStorage(os.path.join(os.path.dirname(MIRROR_PATH) or ".", "logos"))
+    return logos.SupabaseLogoStorage(init_supabase(), "logos")
+
+@st.cache_resource
+@tracing.traced()
+def logo_executor():
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="logo-upload")
+
+# Envois de logo en cours ou en échec, par template (process entier, toutes sessions)
+_logo_uploads = {}
+_logo_uploads_lock = threading.Lock()
+
+def _upload_logo(storage, file_bytes, file_name, digest):
+    logos.process_and_upload(storage, file_bytes, file_name, digest)
+    return logos.logo_fields(storage, digest, file_name)
+
+@tracing.traced()
+def ingest_logo(file_obj, file_name):
+    """
+    Start the renditions and uploads of a logo in the background (identical
+    logos map to the same objects and are stored once). Returns a future of
+    the template fields (logo_url, logo_print_url, logo_thumb_url), to give to
+    attach_logo once the template is saved; None if the upload could not start.
+    """
     try:
         file_bytes = file_obj.getvalue()
-        content_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
-        
-        supabase.storage.from_(bucket_name).upload(
-            path=unique_name,
-            file=file_bytes,
-            file_options={"content-type": content_type, "upsert": "false"}
-        )
-        
-        # Get Public URL
-        public_url = supabase.storage.from_(bucket_name).get_public_url(unique_name)
-        return public_url
+        digest = logos.logo_hash(file_bytes)
+        return logo_executor().submit(_upload_logo, init_logo_storage(), file_bytes, file_name, digest)
+    except Exception as e:
+        st.error(f"Erreur Upload: {e}")
+        return None
+
+def attach_logo(template_id, upload, file_name):
+    """
+    Write the logo fields on the template once every variant is uploaded.
+    Until then the template keeps its previous logo (none for a new one);
+    failures are kept for logo_uploads().
+    """
+    entry = {"template_id": template_id, "file_name": file_name, "error": None}
+    with _logo_uploads_lock:
+        _logo_uploads[template_id] = entry
+
+    def done(future):
+        with _logo_uploads_lock:
+            # Remplacé par un envoi plus récent pour ce template : ignoré
+            if _logo_uploads.get(template_id) is not entry:
+                return
+        error = future.exception()
+        if error is None:
+            try:
+                mirror = init_mirror()
+                # Template supprimé entre-temps : rien à écrire
+                if mirror.get("templates", template_id):
+                    mirror.upsert("templates", future.result(), template_id)
+            except Exception as e:
+                error = e
+        with _logo_uploads_lock:
+            if _logo_uploads.get(template_id) is not entry:
+                return
+            if error is None:
+                del _logo_uploads[template_id]
+            else:
+                logger.warning("Logo upload failed: %s", error)
+                entry["error"] = str(error) or type(error).__name__
+
+    upload.add_done_callback(done)
+
+def logo_uploads():
+    """Logo uploads still running (error None) or failed, one per template."""
+    with _logo_uploads_lock:
+        return [dict(u) for u in _logo_uploads.values()]
+
+def dismiss_logo_upload(template_id):
+    with _logo_uploads_lock:
+        _logo_uploads.pop(template_id, None)
+
+@tracing.traced()
+def upload_logo(file_obj, file_name):
+    """Uploads a file to 'logos' bucket and returns Public URL (waits for the upload)."""
+    upload = ingest_logo(file_obj, file_name)
+    try:
+        return upload.result()["logo_url"] if upload else None
     except Exception as e:
         st.error(f"Erreur Upload: {e}")
         return None
@@ -96,54 +271,88 @@ def upload_logo(file_obj, file_name):
 # EMAIL TEMPLATES CRUD
 # ================================================================
 
+@tracing.traced()
 def get_email_templates():
     """Fetch all email templates ordered by creation date."""
-    supabase = init_supabase()
     try:
-        response = supabase.table("email_templates").select("*").order("created_at", desc=True).execute()
-        return response.data
+        return init_mirror().select("email_templates")
     except Exception as e:
         st.error(f"Erreur Supabase (email_templates): {e}")
         return []
 
+@tracing.traced()
 def create_email_template(name, subject, body):
     """Insert a new email template."""
-    supabase = init_supabase()
     data = {"name": name, "subject": subject, "body": body}
     try:
-        response = supabase.table("email_templates").insert(data).execute()
-        return response.data
+        return [init_mirror().upsert("email_templates", data)]
     except Exception as e:
         st.error(f"Erreur Création email template: {e}")
         return None
 
+@tracing.traced()
 def update_email_template(template_id, name, subject, body):
     """Update an existing email template."""
-    supabase = init_supabase()
-    data = {"name": name, "subject": subject, "body": body}
+    # updated_at : clé du cache des templates compilés (email_sender)
+    data = {"name": name, "subject": subject, "body": body, "updated_at": datetime.now(timezone.utc).isoformat()}
     try:
-        response = supabase.table("email_templates").update(data).eq("id", template_id).execute()
-        return response.data
+        return [init_mirror().upsert("email_templates", data, template_id)]
     except Exception as e:
         st.error(f"Erreur Mise à jour email template: {e}")
         return None
 
+@tracing.traced()
 def delete_email_template(template_id):
     """Delete an email template by ID."""
-    supabase = init_supabase()
     try:
-        response = supabase.table("email_templates").delete().eq("id", template_id).execute()
-        return response.data
+        return init_mirror().delete("email_templates", template_id)
     except Exception as e:
         st.error(f"Erreur Suppression email template: {e}")
         return None
 
+@tracing.traced()
 def update_template_emails(template_id, emails):
     """Update the emails list on a visual template."""
-    supabase = init_supabase()
     try:
-        response = supabase.table("templates").update({"emails": emails}).eq("id", template_id).execute()
-        return response.data
+        return [init_mirror().upsert("templates", {"emails": emails}, template_id)]
     except Exception as e:
         st.error(f"Erreur Mise à jour emails: {e}")
         return None
+
+
+# ================================================================
+# EMAIL DELIVERY (SMTP)
+# ================================================================
+
+@st.cache_resource
+@tracing.traced()
+def init_mailer():
+    """SMTP sender configured by st.secrets["smtp"]; None when no SMTP server is configured."""
+    try:
+        conf = st.secrets["smtp"]
+    except Exception:
+        return None
+    return mailer.SMTPMailer(
+        conf["host"],
+        port=int(conf.get("port", 587)),
+        username=conf.get("username"),
+        password=conf.get("password"),
+        sender=conf.get("sender"),
+        security=conf.get("security", "starttls"),
+        pool_size=int(conf.get("pool_size", 4)),
+        rate_per_minute=int(conf.get("rate_per_minute", 120)),
+        retries=int(conf.get("retries", 3)),
+    )
+
+@tracing.traced()
+def record_email_deliveries(statuses):
+    """Append the delivery status of each sent message to 'email_deliveries'."""
+    if OFFLINE or not statuses:
+        return statuses
+    rows = [dict({k: s[k] for k in ("to", "subject", "message_id", "status", "attempts", "error", "sent_at")},
+                 reference=None if s.get("ref") is None else str(s["ref"])) for s in statuses]
+    try:
+        return init_supabase().table("email_deliveries").insert(rows).execute().data
+    except Exception as e:
+        st.error(f"Erreur Enregistrement envois: {e}")
+        return None
@@ -0,0 +1,394 @@
+"""
+loadtest.py – Concurrent-session load test of the Streamlit app (streamlit.testing AppTest).
+
+    python loadtest.py --sessions 1,2,4,8 --latency-ms 80 --jitter-ms 20
+    python loadtest.py --sessions 4 --pdf "ESTIMATION N° D202601-1078.pdf" --json results.json
+
+Each simulated session drives home -> select_template -> upload_pdf -> preview
+(PDF generation) in one app instance: the sessions share the job manager,
+process pool and caches exactly like real browser sessions. Supabase is
+replaced by an in-memory stand-in that sleeps `latency` on every call.
+
+Reported per concurrency level: latency per step (p50 / p95 / max), session
+throughput, CPU saturation (all cores, process pool included) and memory per
+session. psutil is used when installed; otherwise CPU and memory only cover
+the main process.
+
+Every session gets its own template (distinct colour): the render cache and
+the content-addressed store (disabled here) cannot serve one session from
+another's result.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+# Avant tout import de l'app : pas de store partagé, ni traces ni index des prix
+os.environ.setdefault("RAPIDO_STORE_DIR", "off")
+os.environ.setdefault("RAPIDO_TRACE_PATH", "off")
+os.environ.setdefault("RAPIDO_PRICE_INDEX", "off")
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+DEFAULT_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ESTIMATION N° D202601-1078.pdf")
+STEPS = ("home", "select_template", "upload_pdf", "preview")
+
+
+# ================================================================
+# SUPABASE STAND-IN
+# ================================================================
+
+class _FakeQuery:
+    def __init__(self, db, table):
+        self._db = db
+        self._table = table
+        self._op = "select"
+        self._payload = None
+        self._filters = []
+
+    def select(self, *columns, **kwargs):
+        self._op = "select"
+        return self
+
+    def insert(self, payload, **kwargs):
+        self._op, self._payload = "insert", payload
+        return self
+
+    def upsert(self, payload, **kwargs):
+        self._op, self._payload = "upsert", payload
+        return self
+
+    def update(self, payload, **kwargs):
+        self._op, self._payload = "update", payload
+        return self
+
+    def delete(self, **kwargs):
+        self._op = "delete"
+        return self
+
+    def eq(self, column, value):
+        self._filters.append((column, str(value)))
+        return self
+
+    def order(self, *args, **kwargs):
+        return self
+
+    def limit(self, *args, **kwargs):
+        return self
+
+    def execute(self):
+        self._db.wait()
+        with self._db.lock:
+            rows = self._db.tables.setdefault(self._table, {})
+            matching = [r for r in rows.values() if all(str(r.get(c)) == v for c, v in self._filters)]
+            if self._op == "select":
+                data = [dict(r) for r in matching]
+            elif self._op in ("insert", "upsert"):
+                payload = self._payload if isinstance(self._payload, list) else [self._payload]
+                data = []
+                for row in payload:
+                    row = dict(row)
+                    row.setdefault("id", str(uuid.uuid4()))
+                    row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+                    rows[str(row["id"])] = dict(rows.get(str(row["id"]), {}), **row)
+                    data.append(rows[str(row["id"])])
+            elif self._op == "update":
+                for r in matching:
+                    r.update(self._payload)
+                data = [dict(r) for r in matching]
+            else:
+                for r in matching:
+                    rows.pop(str(r["id"]), None)
+                data = matching
+        return SimpleNamespace(data=data)
+
+
+class _FakeBucket:
+    def __init__(self, db, name):
+        self._db = db
+        self._name = name
+
+    def list(self, folder=""):
+        self._db.wait()
+        prefix = f"{folder}/" if folder else ""
+        with self._db.lock:
+            return [{"name": p[len(prefix):]} for p in self._db.objects.get(self._name, {}) if p.startswith(prefix)]
+
+    def upload(self, path, file, file_options=None):
+        self._db.wait()
+        with self._db.lock:
+            self._db.objects.setdefault(self._name, {})[path] = file
+
+    def get_public_url(self, path):
+        return f"fake://{self._name}/{path}"
+
+
+class FakeSupabase:
+    """In-memory Supabase client (tables + storage); every call sleeps latency ± jitter."""
+
+    def __init__(self, latency_ms=50.0, jitter_ms=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.objects = {}
+        self.calls = 0
+        self._random = random.Random(seed)
+        self.storage = SimpleNamespace(from_=lambda bucket: _FakeBucket(self, bucket))
+
+    def wait(self):
+        with self.lock:
+            self.calls += 1
+            delay = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms))
+        time.sleep(delay / 1000)
+
+    def table(self, name):
+        return _FakeQuery(self, name)
+
+    def seed_templates(self, count):
+        now = datetime.now(timezone.utc)
+        rows = self.tables.setdefault("templates", {})
+        for i in range(count):
+            template_id = str(uuid.uuid4())
+            rows[template_id] = {
+                "id": template_id,
+                "created_at": now.replace(microsecond=i).isoformat(),
+                "name": f"Charge {i + 1:03d}",
+                "company_name": f"Entreprise {i + 1}",
+                "company_address": "1 rue du Test, 75000 Paris",
+                "primary_color": f"#{(i * 2654435761) & 0xFFFFFF:06x}",
+                "logo_url": None,
+                "logo_print_url": None,
+                "logo_thumb_url": None,
+                "emails": [],
+                "is_default": False,
+            }
+        return list(rows.values())
+
+
+def install_fake_backend(fake, mirror_path):
+    """Point db.py at the stand-in (pooled, so the app's latency histograms still work)."""
+    import db
+    from rapido.supabase_pool import SupabasePool
+
+    pool = SupabasePool("fake://supabase", "fake-key", size=8)
+    pool._new_client = lambda: fake
+    db.OFFLINE = False
+    db.MIRROR_PATH = mirror_path
+    db.init_supabase = lambda: pool
+    return pool
+
+
+# ================================================================
+# SESSION SIMULÉE
+# ================================================================
+
+class _Upload:
+    """What st.file_uploader returns, as far as the upload view is concerned."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.size = len(data)
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+def _button(at, label):
+    for b in at.button:
+        if b.label == label:
+            return b
+    raise AssertionError(f"Bouton introuvable : {label!r} (étape {at.session_state['step']})")
+
+
+def _check(at):
+    if at.exception:
+        raise AssertionError(f"Exception dans l'app : {at.exception[0].value}")
+
+
+def _run_until(at, done, timeout):
+    """Rerun until done(at) (jobs are polled by reruns), return elapsed seconds."""
+    start = time.perf_counter()
+    at.run()
+    _check(at)
+    while not done(at):
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError(f"Étape {at.session_state['step']} > {timeout}s")
+        at.run()
+        _check(at)
+    return time.perf_counter() - start
+
+
+def run_session(index, template, pdf_name, pdf_bytes, timeout):
+    """One estimator, end to end. Returns {step: seconds} (or {"error": ...})."""
+    from streamlit.testing.v1 import AppTest
+
+    timings = {}
+    try:
+        at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+        timings["home"] = _run_until(at, lambda a: True, timeout)
+
+        _button(at, "🚀 NOUVEAU DEVIS").click()
+        timings["select_template"] = _run_until(at, lambda a: a.session_state["step"] == "select_template", timeout)
+
+        # Validation + import + extraction (suivie par reruns) jusqu'à l'aperçu
+        at.selectbox[0].set_value(template["id"])
+        at.session_state["loadtest_upload"] = _Upload(pdf_name, pdf_bytes)
+        _button(at, "Valider et Continuer ➡️").click()
+        timings["upload_pdf"] = _run_until(at, lambda a: a.session_state["step"] == "preview", timeout)
+
+        _button(at, "📄 Générer le PDF").click()
+        timings["preview"] = _run_until(
+            at, lambda a: "generated_pdf_handle" in a.session_state and "render_job_id" not in a.session_state, timeout)
+    except Exception as e:
+        timings["error"] = f"session {index}: {type(e).__name__}: {e}"
+    return timings
+
+
+# ================================================================
+# MESURES
+# ================================================================
+
+class ResourceProbe:
+    """CPU time and RSS of this process (+ children with psutil)."""
+
+    def __init__(self):
+        try:
+            import psutil
+            self._process = psutil.Process()
+        except ImportError:
+            self._process = None
+
+    def _tree(self):
+        return [self._process] + self._process.children(recursive=True)
+
+    def cpu_seconds(self):
+        if self._process is None:
+            t = os.times()
+            return t.user + t.system
+        total = 0.0
+        for p in self._tree():
+            try:
+                c = p.cpu_times()
+                total += c.user + c.system
+            except Exception:
+                pass
+        return total
+
+    def rss_bytes(self):
+        if self._process is None:
+            import resource
+            # ru_maxrss : pic (Ko sous Linux), faute de mieux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        total = 0
+        for p in self._tree():
+            try:
+                total += p.memory_info().rss
+            except Exception:
+                pass
+        return total
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[max(0, min(len(values), -(-len(values) * p // 100)) - 1)]
+
+
+def run_level(n, templates, pdf_name, pdf_bytes, timeout, probe):
+    results = [None] * n
+    rss_before = probe.rss_bytes()
+    cpu_before = probe.cpu_seconds()
+    start = time.perf_counter()
+
+    def worker(i):
+        results[i] = run_session(i, templates[i % len(templates)], pdf_name, pdf_bytes, timeout)
+    threads = [threading.Thread(target=worker, args=(i,), name=f"loadtest-{i}") for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    wall = time.perf_counter() - start
+    cpu = probe.cpu_seconds() - cpu_before
+    rss_after = probe.rss_bytes()
+    ok = [r for r in results if "error" not in r]
+    report = {
+        "sessions": n,
+        "ok": len(ok),
+        "errors": [r["error"] for r in results if "error" in r],
+        "wall_s": round(wall, 2),
+        "sessions_per_min": round(len(ok) / wall * 60, 1) if wall else 0.0,
+        "cpu_saturation_pct": round(cpu / (wall * (os.cpu_count() or 1)) * 100, 1) if wall else 0.0,
+        "rss_mb": round(rss_after / 2**20, 1),
+        "rss_per_session_mb": round((rss_after - rss_before) / 2**20 / n, 2),
+        "steps": {},
+    }
+    for step in STEPS:
+        values = [r[step] * 1000 for r in ok if step in r]
+        if values:
+            report["steps"][step] = {
+                "p50_ms": round(statistics.median(values), 1),
+                "p95_ms": round(_percentile(values, 95), 1),
+                "max_ms": round(max(values), 1),
+            }
+    return report
+
+
+def print_report(report):
+    print(f"\n=== {report['sessions']} session(s) simultanée(s) – {report['ok']} OK en {report['wall_s']} s "
+          f"({report['sessions_per_min']} sessions/min)")
+    print(f"CPU : {report['cpu_saturation_pct']} % de {os.cpu_count()} cœur(s) – "
+          f"RSS : {report['rss_mb']} Mo ({report['rss_per_session_mb']:+} Mo/session)")
+    print(f"{'étape':<18}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for step, s in report["steps"].items():
+        print(f"{step:<18}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['max_ms']:>10}")
+    for error in report["errors"][:5]:
+        print(f"  ! {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sessions", default="1,2,4,8", help="Niveaux de concurrence, ex. 1,2,4,8")
+    parser.add_argument("--pdf", default=DEFAULT_PDF, help="PDF fournisseur importé par chaque session")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Latence de chaque appel Supabase simulé")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=180.0, help="Délai max par étape (s)")
+    parser.add_argument("--json", help="Écrit aussi les résultats dans ce fichier")
+    args = parser.parse_args(argv)
+
+    levels = [int(n) for n in args.sessions.split(",") if n.strip()]
+    with open(args.pdf, "rb") as f:
+        pdf_bytes = f.read()
+
+    fake = FakeSupabase(args.latency_ms, args.jitter_ms, seed=0)
+    templates = fake.seed_templates(max(levels))
+    workdir = tempfile.mkdtemp(prefix="rapido-loadtest-")
+    pool = install_fake_backend(fake, os.path.join(workdir, "mirror.sqlite3"))
+    probe = ResourceProbe()
+
+    reports = []
+    for n in levels:
+        report = run_level(n, templates, os.path.basename(args.pdf), pdf_bytes, args.timeout, probe)
+        print_report(report)
+        reports.append(report)
+
+    print(f"\nAppels Supabase simulés : {fake.calls}")
+    for row in pool.latency_report():
+        print(f"  {row['table']:<24}{row['operation']:<10}n={row['count']:<6}p50={row['p50_ms']} ms  p95={row['p95_ms']} ms")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "levels": reports}, f, indent=2)
+    return 0 if all(not r["errors"] for r in reports) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4 @@
+"""
+rapido – Headless core of Rapido'Devis: extraction, rendering, email and job plumbing.
+No Streamlit here; heavy libraries (pdfplumber, fpdf) are imported on first use.
+"""
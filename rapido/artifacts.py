@@ -0,0 +1,204 @@
+"""
+artifacts.py – Session artifacts (extracted estimates, generated PDFs) kept out of st.session_state.
+Small in-memory working set, spill-to-disk beyond it, eviction by size and idle age.
+Files produced on disk (batch zips) can be handed over to the store too, so
+they share the disk budget and go away with idle sessions.
+Session state only keeps the returned handles. Objects are spilled in the
+binary estimate format (estimate_codec.py).
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from rapido import estimate_codec
+
+BYTES = "bytes"
+OBJECT = "object"
+FILE = "file"
+
+
+class _Entry:
+    __slots__ = ("kind", "size", "last_access", "value", "pins")
+
+    def __init__(self, kind, size, value):
+        self.kind = kind
+        self.size = size
+        self.last_access = time.time()
+        self.value = value  # None once spilled to disk
+        self.pins = 0  # > 0 : en cours d'utilisation, ni déchargé ni supprimé
+
+
+class ArtifactStore:
+    """
+    Objects (dicts) are stored by reference while in memory, so in-place edits
+    are kept; they are serialised only when spilled. An object edited in place
+    must be held with pinned(handle) for as long as it is being modified: a
+    pinned entry is never spilled (nor evicted), so edits are neither lost nor
+    serialised half-way by another session's put.
+    """
+
+    def __init__(self, spill_dir=None, max_memory_bytes=32 * 1024 * 1024,
+                 max_disk_bytes=1024 * 1024 * 1024, max_idle_seconds=2 * 3600):
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix="rapido-artifacts-")
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_idle_seconds = max_idle_seconds
+        self._entries = OrderedDict()  # LRU order, memory + disk
+        self._memory = 0
+        self._disk = 0
+        self._lock = threading.Lock()
+
+    # --- API ---
+    def put_bytes(self, data, kind="pdf"):
+        return self._put(BYTES, bytes(data), len(data), kind)
+
+    def put_object(self, obj, kind="estimate"):
+        size = len(json.dumps(obj, ensure_ascii=False))
+        return self._put(OBJECT, obj, size, kind)
+
+    def put_file(self, path, kind="file"):
+        """Move the file at `path` into the store (disk only, never loaded in memory)."""
+        handle = f"{kind}-{uuid.uuid4().hex}"
+        shutil.move(path, self._path(handle))
+        with self._lock:
+            entry = self._entries[handle] = _Entry(FILE, os.path.getsize(self._path(handle)), None)
+            self._disk += entry.size
+            self._evict(keep=handle)
+        return handle
+
+    def get_path(self, handle):
+        """Path of a file put with put_file(), None if it was deleted or evicted."""
+        if not handle:
+            return None
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None or entry.kind != FILE:
+                return None
+            entry.last_access = time.time()
+            self._entries.move_to_end(handle)
+            return self._path(handle)
+
+    def get_bytes(self, handle):
+        return self._get(handle, BYTES)
+
+    def get_object(self, handle):
+        return self._get(handle, OBJECT)
+
+    @contextmanager
+    def pinned(self, handle):
+        """Keep `handle` in memory (once loaded) until the block exits. No-op for unknown handles."""
+        with self._lock:
+            entry = self._entries.get(handle) if handle else None
+            if entry is not None:
+                entry.pins += 1
+        try:
+            yield
+        finally:
+            if entry is not None:
+                with self._lock:
+                    entry.pins -= 1
+
+    def delete(self, handle):
+        if not handle:
+            return
+        with self._lock:
+            entry = self._entries.pop(handle, None)
+            if entry is not None:
+                self._drop(handle, entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "memory_bytes": self._memory,
+                "disk_bytes": self._disk,
+            }
+
+    # --- Internals ---
+    def _path(self, handle):
+        return os.path.join(self.spill_dir, handle)
+
+    def _put(self, storage, value, size, kind):
+        handle = f"{kind}-{uuid.uuid4().hex}"
+        with self._lock:
+            self._entries[handle] = _Entry(storage, size, value)
+            self._memory += size
+            self._evict()
+        return handle
+
+    def _get(self, handle, storage):
+        if not handle:
+            return None
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None or entry.kind != storage:
+                return None
+            if entry.value is None:
+                self._load(handle, entry)
+            entry.last_access = time.time()
+            self._entries.move_to_end(handle)
+            value = entry.value
+            self._evict(keep=handle)
+            return value
+
+    def _load(self, handle, entry):
+        with open(self._path(handle), "rb") as f:
+            raw = f.read()
+        os.remove(self._path(handle))
+        self._disk -= entry.size
+        if entry.kind == OBJECT:
+            raw = estimate_codec.decode(raw) if estimate_codec.is_encoded(raw) else json.loads(raw.decode("utf-8"))
+        entry.value = raw
+        self._memory += entry.size
+
+    def _spill(self, handle, entry):
+        raw = entry.value
+        if entry.kind == OBJECT:
+            raw = estimate_codec.encode(raw)
+        tmp = self._path(handle) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(raw)
+        os.replace(tmp, self._path(handle))
+        # Un objet édité en place a pu changer de taille : on repart de la taille sérialisée
+        self._memory -= entry.size
+        entry.size = len(raw)
+        entry.value = None
+        self._disk += entry.size
+
+    def _drop(self, handle, entry):
+        if entry.value is None:
+            self._disk -= entry.size
+            try:
+                os.remove(self._path(handle))
+            except FileNotFoundError:
+                pass
+        else:
+            self._memory -= entry.size
+
+    def _evict(self, keep=None):
+        now = time.time()
+        # 1. Artefacts inactifs depuis trop longtemps : supprimés
+        for handle, entry in list(self._entries.items()):
+            if handle != keep and not entry.pins and now - entry.last_access > self.max_idle_seconds:
+                del self._entries[handle]
+                self._drop(handle, entry)
+        # 2. Working set mémoire trop gros : les moins récents partent sur disque
+        for handle, entry in list(self._entries.items()):
+            if self._memory <= self.max_memory_bytes:
+                break
+            if handle != keep and not entry.pins and entry.value is not None:
+                self._spill(handle, entry)
+        # 3. Zone disque pleine : les plus anciens sont supprimés
+        for handle, entry in list(self._entries.items()):
+            if self._disk <= self.max_disk_bytes:
+                break
+            if handle != keep and not entry.pins and entry.value is None:
+                del self._entries[handle]
+                self._drop(handle, entry)
@@ -0,0 +1,202 @@
+"""
+assets.py – Template assets kept warm between renders: logo bytes, decoded logo,
+colour palette, parsed fonts.
+Every render reuses them: fonts are parsed once per process (add_font) and the
+logo is downloaded and decoded once (preload_logo), instead of fpdf reading the
+font files and decoding the image again for each document. prefetch(config) is
+started as soon as a template is selected, so the first render of the session
+does not pay for them either.
+"""
+import copy
+import hashlib
+import io
+import threading
+import urllib.request
+from collections import OrderedDict
+from functools import lru_cache
+
+from rapido import tracing
+
+LOGO_CACHE_MAX = 32
+LOGO_TIMEOUT = 10.0
+# Niveaux de teinte des lignes de catégorie (1, 2, 3...) et sous-catégorie (1.1, 1.2...)
+TINT_LEVELS = (0.85, 0.95)
+
+_logos = OrderedDict()
+_logos_lock = threading.Lock()
+_decoded = OrderedDict()
+_fonts = {}
+_fonts_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def fpdf_internals_supported():
+    """
+    add_font and preload_logo copy fpdf2 internals (font and image cache
+    entries), checked against fpdf2 2.8. With another version they fall back
+    to fpdf's public add_font and image().
+    """
+    import fpdf
+    from fpdf.fonts import TTFFont
+    return (fpdf.FPDF_VERSION.split(".")[:2] == ["2", "8"]
+            and all(hasattr(TTFFont, a) for a in ("i", "cw", "desc", "subset", "missing_glyphs", "_hbfont")))
+
+
+# --- Logos ---
+def _download(path):
+    if path.startswith(("http://", "https://")):
+        with urllib.request.urlopen(path, timeout=LOGO_TIMEOUT) as resp:
+            return resp.read()
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def logo_bytes(path):
+    """Logo content, downloaded once per process (LRU of LOGO_CACHE_MAX logos). None if unreachable."""
+    if not path:
+        return None
+    with _logos_lock:
+        if path in _logos:
+            _logos.move_to_end(path)
+            return _logos[path]
+    try:
+        data = _download(path)
+    except Exception:
+        return None
+    with _logos_lock:
+        _logos[path] = data
+        while len(_logos) > LOGO_CACHE_MAX:
+            _logos.popitem(last=False)
+    return data
+
+
+def logo_missing(config):
+    """True when the config has a logo that cannot be fetched: renders made meanwhile are not cached."""
+    path = config.get('logo_path')
+    return bool(path) and logo_bytes(path) is None
+
+
+def decoded_logo(data):
+    """
+    Logo decoded by fpdf, once per process: (name, image info, ICC profiles),
+    or None if the image cannot be read.
+    """
+    key = hashlib.sha256(data).digest()
+    with _logos_lock:
+        if key in _decoded:
+            _decoded.move_to_end(key)
+            return _decoded[key]
+    from fpdf.image_datastructures import ImageCache
+    from fpdf.image_parsing import preload_image
+    seed = ImageCache()
+    try:
+        name, _, info = preload_image(seed, io.BytesIO(data))
+        decoded = (name, info, dict(seed.icc_profiles))
+    except Exception:
+        decoded = None
+    with _logos_lock:
+        _decoded[key] = decoded
+        while len(_decoded) > LOGO_CACHE_MAX:
+            _decoded.popitem(last=False)
+    return decoded
+
+
+def preload_logo(pdf, path):
+    """
+    What to give pdf.image() for the logo at `path`. The decoded image is put in
+    the document's image cache, so image() finds it instead of decoding the
+    bytes again. None when the logo cannot be decoded (fpdf would fail too).
+    """
+    data = logo_bytes(path)
+    if data is None:
+        return path
+    if not fpdf_internals_supported():
+        return io.BytesIO(data)
+    decoded = decoded_logo(data)
+    if decoded is None:
+        return None
+    name, info, icc_profiles = decoded
+    cache = pdf.image_cache
+    if name not in cache.images:
+        # Copie par document : fpdf y inscrit ses numéros d'objets et compteurs d'usage
+        info = copy.copy(info)
+        info["i"] = len(cache.images) + 1
+        info["usages"] = 0
+        info.pop("obj_id", None)
+        if info.get("iccp_i") is not None:
+            profile = next(p for p, i in icc_profiles.items() if i == info["iccp_i"])
+            info["iccp_i"] = cache.icc_profiles.setdefault(profile, len(cache.icc_profiles))
+        cache.images[name] = info
+    return io.BytesIO(data)
+
+
+# --- Couleurs ---
+@lru_cache(maxsize=256)
+def palette(hex_color):
+    """'#0056b3' -> {"rgb": (0, 86, 179), "tints": ((r, g, b) per TINT_LEVELS)}."""
+    from rapido.rendering import get_tint
+    hex_color = (hex_color or '#0056b3').lstrip('#')
+    rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    return {"rgb": rgb, "tints": tuple(get_tint(*rgb, level) for level in TINT_LEVELS)}
+
+
+# --- Fontes ---
+def _parsed_font(family, style, fname):
+    # Police lue une fois par process (tables, métriques, cmap) ; jamais modifiée ensuite
+    key = (family, style, fname)
+    with _fonts_lock:
+        font = _fonts.get(key)
+        if font is None:
+            from fpdf import FPDF
+            scratch = FPDF()
+            scratch.add_font(family, style=style, fname=fname)
+            font = _fonts[key] = scratch.fonts[f"{family.lower()}{style}"]
+        return font
+
+
+def add_font(pdf, family, style, fname):
+    """
+    pdf.add_font(family, style, fname) without parsing the font file again.
+    The document gets its own per-document state: glyph subset, widths, font
+    descriptor, and a fresh (lazy) fontTools object, since fpdf subsets it in
+    place on output.
+    """
+    if not fpdf_internals_supported():
+        pdf.add_font(family, style=style, fname=fname)
+        return
+    from fontTools import ttLib
+    from fpdf.fonts import SubsetMap
+    parsed = _parsed_font(family, style, fname)
+    font = copy.copy(parsed)
+    font.i = len(pdf.fonts) + 1
+    font.ttfont = ttLib.TTFont(fname, recalcTimestamp=False, lazy=True)
+    font.cw = copy.copy(parsed.cw)
+    # Descripteur : objet PDF numéroté à la sortie de chaque document
+    font.desc = copy.copy(parsed.desc)
+    font.missing_glyphs = []
+    font.biggest_size_pt = 0
+    font._hbfont = None
+    font.subset = SubsetMap(font)
+    pdf.fonts[parsed.fontkey] = font
+
+
+def warm_fonts():
+    """Import fpdf, build the PDF class and parse the fonts of the renderer (once per process)."""
+    from rapido.rendering import FONTS, get_pdf_class
+    get_pdf_class()
+    for family, style, fname in FONTS:
+        _parsed_font(family, style, fname)
+
+
+@tracing.traced()
+def prefetch(config):
+    """Warm everything a render of this template config needs. Returns what was prepared."""
+    result = {"palette": palette(config.get('color', '#0056b3')), "logo": None}
+    warm_fonts()
+    data = logo_bytes(config.get('logo_path'))
+    if data is not None and fpdf_internals_supported():
+        decoded = decoded_logo(data)
+        # Fichier illisible : pas de logo au rendu, comme avant
+        result["logo"] = (decoded[1]["w"], decoded[1]["h"]) if decoded else None
+    tracing.annotate(logo=result["logo"] is not None)
+    return result
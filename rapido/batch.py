@@ -0,0 +1,184 @@
+"""
+batch.py – Multi-file workflow: concurrent extraction, summary grid, parallel rendering, zip export and bulk email.
+CPU-bound work (pdfplumber, fpdf) is fanned out to a process pool so a batch
+is bounded by the number of cores rather than by the GIL.
+"""
+import os
+import tempfile
+import zipfile
+from concurrent.futures import as_completed
+
+# Écart toléré entre la somme des lignes et le total HT extrait
+TOTAL_TOLERANCE = 0.05
+
+
+def _extract_one(name, file_bytes):
+    # Import local : exécuté dans un process worker (sans Streamlit)
+    from rapido.cas import extract_cached
+    try:
+        return {"name": name, "data": extract_cached(file_bytes), "error": None}
+    except Exception as e:
+        return {"name": name, "data": None, "error": str(e)}
+
+
+def _render_one(name, data, config):
+    from rapido.cas import render_cached
+    return name, render_cached(data, config)
+
+
+def extract_all(executor, files, progress=None):
+    """files: list of (name, bytes). Returns results in input order."""
+    futures = {executor.submit(_extract_one, name, raw): i for i, (name, raw) in enumerate(files)}
+    results = [None] * len(files)
+    try:
+        for done, fut in enumerate(as_completed(futures), 1):
+            results[futures[fut]] = fut.result()
+            if progress:
+                progress(done / len(files), f"{done}/{len(files)} fichiers analysés")
+    except BaseException:
+        # Annulation (ou erreur) : on libère le pool des fichiers pas encore commencés
+        for fut in futures:
+            fut.cancel()
+        raise
+    return results
+
+
+def warnings_for(data):
+    """Anomalies to surface in the summary grid."""
+    warnings = []
+    if data.get('numero_devis', "INCONNU") == "INCONNU":
+        warnings.append("N° introuvable")
+    if not data.get('client', {}).get('nom'):
+        warnings.append("Client introuvable")
+    items = [n['data'] for n in data.get('content', []) if n['type'] == 'item']
+    if not items:
+        warnings.append("Aucune ligne")
+    from rapido.totals import compute_totals
+    computed = compute_totals(data.get('content', []))
+    if items and abs(computed['total_ht'] - float(data.get('total_ht') or 0)) > TOTAL_TOLERANCE:
+        warnings.append(f"Σ lignes {computed['total_ht']:,.2f} ≠ HT".replace(',', ' '))
+    if computed['mismatches']:
+        warnings.append(f"{len(computed['mismatches'])} ligne(s) Qté × PU ≠ total")
+    if not data.get('total_ttc'):
+        warnings.append("Total TTC absent")
+    return warnings
+
+
+def summary_rows(results):
+    rows = []
+    for r in results:
+        data = r['data']
+        if data is None:
+            rows.append({"fichier": r['name'], "numero": "", "client": "", "lignes": 0,
+                         "total_ht": 0.0, "tva": 0.0, "total_ttc": 0.0, "alertes": f"Erreur : {r['error']}"})
+            continue
+        rows.append({
+            "fichier": r['name'],
+            "numero": data.get('numero_devis', ""),
+            "client": data.get('client', {}).get('nom', ""),
+            "lignes": sum(1 for n in data.get('content', []) if n['type'] == 'item'),
+            "total_ht": data.get('total_ht', 0.0),
+            "tva": data.get('tva', 0.0),
+            "total_ttc": data.get('total_ttc', 0.0),
+            "alertes": ", ".join(warnings_for(data)),
+        })
+    return rows
+
+
+def _pdf_name(result, used):
+    data = result['data']
+    base = f"Estimation_{data.get('numero_devis', 'Inconnu')}"
+    if base == "Estimation_INCONNU":
+        base = os.path.splitext(result['name'])[0]
+    name, n = f"{base}.pdf", 2
+    while name in used:
+        name, n = f"{base}_{n}.pdf", n + 1
+    used.add(name)
+    return name
+
+
+def render_all_to_zip(executor, results, config, progress=None):
+    """
+    Render every successful extraction and stream each PDF into a zip on disk
+    as soon as it is ready. A render that fails does not stop the batch: it is
+    listed in the result and in an errors.txt inside the zip.
+    Returns {"path": zip path, "pdfs": number of PDFs, "errors": [{"fichier", "error"}]}.
+    """
+    used = set()
+    todo = [(_pdf_name(r, used), r) for r in results if r['data'] is not None]
+    errors = []
+    fd, zip_path = tempfile.mkstemp(prefix="rapido-batch-", suffix=".zip")
+    # PDF déjà compressés : ZIP_STORED évite de recompresser pour rien
+    with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", compression=zipfile.ZIP_STORED) as zf:
+        futures = {executor.submit(_render_one, name, r['data'], config): r['name'] for name, r in todo}
+        try:
+            for done, fut in enumerate(as_completed(futures), 1):
+                try:
+                    name, pdf_bytes = fut.result()
+                except Exception as e:
+                    errors.append({"fichier": futures[fut], "error": str(e) or type(e).__name__})
+                else:
+                    zf.writestr(name, pdf_bytes)
+                if progress:
+                    progress(done / len(todo), f"{done}/{len(todo)} PDF générés")
+            if errors:
+                # Ordre des fichiers importés, pas celui de fin des rendus
+                order = {r['name']: i for i, r in enumerate(results)}
+                errors.sort(key=lambda e: order[e['fichier']])
+                zf.writestr("errors.txt", "".join(f"{e['fichier']} : {e['error']}\n" for e in errors))
+        except BaseException:
+            for fut in futures:
+                fut.cancel()
+            zf.close()
+            os.remove(zip_path)
+            raise
+    return {"path": zip_path, "pdfs": len(todo) - len(errors), "errors": errors}
+
+
+def email_all(executor, mailer, results, config, email_template, template, recipients, progress=None):
+    """
+    Render each estimate that has a recipient, then send it with its PDF
+    attached through `mailer` (see rapido.mailer). recipients: {file name: email}.
+    Returns one delivery status per message (ref = file name), in input order.
+    A render that fails does not stop the batch: that message gets a failed
+    status (0 attempts) and the others are sent.
+    """
+    from rapido.email_sender import build_template_variables, render_email_batch
+    from rapido.mailer import FAILED
+
+    todo = [r for r in results if r['data'] is not None and recipients.get(r['name'])]
+    if not todo:
+        return []
+    used = set()
+    names = [_pdf_name(r, used) for r in todo]
+    rendered = render_email_batch(email_template, [build_template_variables(r['data'], template) for r in todo])
+    # Moitié de la progression pour le rendu, moitié pour l'envoi
+    futures = {executor.submit(_render_one, name, r['data'], config): i for i, (name, r) in enumerate(zip(names, todo))}
+    pdfs = [None] * len(todo)
+    statuses = [None] * len(todo)
+    try:
+        for done, fut in enumerate(as_completed(futures), 1):
+            i = futures[fut]
+            try:
+                pdfs[i] = fut.result()[1]
+            except Exception as e:
+                statuses[i] = {"ref": todo[i]['name'], "to": recipients[todo[i]['name']],
+                               "subject": rendered[i]['subject'], "message_id": None, "status": FAILED,
+                               "attempts": 0, "error": f"Rendu PDF : {str(e) or type(e).__name__}", "sent_at": None}
+            if progress:
+                progress(done / len(todo) / 2, f"{done}/{len(todo)} PDF générés")
+    except BaseException:
+        for fut in futures:
+            fut.cancel()
+        raise
+
+    to_send = [i for i in range(len(todo)) if statuses[i] is None]
+    messages = [
+        (todo[i]['name'], mailer.message(recipients[todo[i]['name']], rendered[i]['subject'], rendered[i]['body'],
+                                         [(names[i], pdfs[i], "application/pdf")]))
+        for i in to_send
+    ]
+    send_progress = (lambda p, msg: progress(0.5 + p / 2, msg)) if progress else None
+    for i, status in zip(to_send, mailer.send_bulk(messages, progress=send_progress)):
+        statuses[i] = status
+    return statuses
@@ -0,0 +1,209 @@
+"""
+cas.py – Content-addressed persistent store for extraction results and rendered PDFs.
+Extraction results are keyed by PDF hash + extractor version, rendered PDFs by
+estimate hash + logo hash + template hash + renderer version: a PDF rendered
+while the logo could not be fetched is never stored. The local-filesystem
+store writes atomically, so every replica pointed at the same directory
+(shared volume) reuses the others' results. It is bounded in size: reads
+refresh the file's mtime and the least recently used files are evicted.
+
+    RAPIDO_STORE_DIR=/srv/rapido-store   (default ~/.cache/rapido/store, "off" to disable)
+    RAPIDO_STORE_MAX_MB=2048             (default 1024)
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from functools import lru_cache
+
+from rapido import tracing
+from rapido.render_cache import normalise_json
+
+logger = logging.getLogger(__name__)
+
+EXTRACTIONS = "extractions"
+RENDERS = "renders"
+MAX_BYTES = 1024 * 1024 * 1024
+# Après éviction, le store redescend à cette fraction de max_bytes (évite d'évincer à chaque écriture)
+LOW_WATER = 0.9
+
+
+class LocalFSStore:
+    def __init__(self, root, max_bytes=MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        # Taille estimée par ce process ; recalculée à chaque éviction (les autres réplicas écrivent aussi)
+        self._size = None
+
+    def _path(self, namespace, key):
+        # Répartition sur 256 sous-dossiers pour éviter les répertoires géants
+        return os.path.join(self.root, namespace, key[:2], key)
+
+    def get(self, namespace, key):
+        path = self._path(namespace, key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # mtime = dernier accès, pour l'éviction LRU (atime n'est pas fiable : noatime, relatime)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, namespace, key, data):
+        path = self._path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Écriture atomique : un autre réplica ne lit jamais un fichier partiel
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self._lock:
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._size = self._evict(int(self.max_bytes * LOW_WATER))
+
+    def _files(self):
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if not name.startswith(".tmp-"):
+                    yield os.path.join(dirpath, name)
+
+    def size(self):
+        total = 0
+        for path in self._files():
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return total
+
+    def _evict(self, target):
+        """Delete the least recently used files until the store holds at most `target` bytes. Returns the new size."""
+        entries = []
+        for path in self._files():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    def contains(self, namespace, key):
+        return os.path.exists(self._path(namespace, key))
+
+
+@lru_cache(maxsize=None)
+def default_store():
+    """Store configured by RAPIDO_STORE_DIR and RAPIDO_STORE_MAX_MB (None when disabled)."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    root = os.environ.get("RAPIDO_STORE_DIR", os.path.join(cache_home, "rapido", "store"))
+    if root.lower() in ("", "off", "none"):
+        return None
+    max_mb = os.environ.get("RAPIDO_STORE_MAX_MB")
+    return LocalFSStore(os.path.abspath(root), int(max_mb) * 1024 * 1024 if max_mb else MAX_BYTES)
+
+
+def _sha256(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def estimate_hash(data):
+    return _sha256(normalise_json(data))
+
+
+def template_hash(config):
+    return _sha256(normalise_json(config))
+
+
+def extraction_key(pdf_bytes):
+    from rapido.extraction import EXTRACTOR_VERSION
+    return _sha256(hashlib.sha256(pdf_bytes).hexdigest(), EXTRACTOR_VERSION)
+
+
+def render_key(data, config, logo=None):
+    """logo: the logo bytes the PDF is drawn with (None without logo)."""
+    from rapido.rendering import RENDERER_VERSION
+    logo_hash = hashlib.sha256(logo).hexdigest() if logo is not None else ""
+    return _sha256(estimate_hash(data), logo_hash, template_hash(config), RENDERER_VERSION)
+
+
+def _index_prices(key, data):
+    # Index des prix historiques : mis à jour à chaque PDF vu (une fois par source)
+    from rapido.price_index import default_index
+    index = default_index()
+    if index is None:
+        return
+    try:
+        index.add_estimate(key, data)
+    except Exception as e:
+        logger.warning("Price index update failed: %s", e)
+
+
+@tracing.traced()
+def extract_cached(pdf_bytes, store=None, progress=None):
+    """extract_data_from_pdf on raw bytes, looked up in the store first."""
+    from rapido.extraction import extract_data_from_pdf
+    store = store or default_store()
+    key = extraction_key(pdf_bytes)
+    raw = store.get(EXTRACTIONS, key) if store else None
+    tracing.annotate(hit=raw is not None)
+    if raw is not None:
+        data = json.loads(raw)
+    else:
+        data = extract_data_from_pdf(io.BytesIO(pdf_bytes), progress=progress)
+        if store:
+            store.put(EXTRACTIONS, key, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+    _index_prices(key, data)
+    return data
+
+
+@tracing.traced()
+def render_cached(data, config, store=None, progress=None):
+    """
+    generate_pdf, looked up in the store first. Renders whose logo could not be
+    fetched are not stored (nor looked up): the next render tries the logo again.
+    """
+    from rapido.assets import logo_bytes
+    from rapido.rendering import generate_pdf
+    store = store or default_store()
+    if store:
+        logo = logo_bytes(config.get('logo_path'))
+        if config.get('logo_path') and logo is None:
+            store = None
+    key = render_key(data, config, logo) if store else None
+    if store:
+        pdf_bytes = store.get(RENDERS, key)
+        tracing.annotate(hit=pdf_bytes is not None)
+        if pdf_bytes is not None:
+            return pdf_bytes
+    pdf_bytes = generate_pdf(data, config, progress=progress)
+    if store:
+        store.put(RENDERS, key, pdf_bytes)
+    return pdf_bytes
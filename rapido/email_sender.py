@@ -0,0 +1,109 @@
+"""
+email_sender.py – Renders email templates and builds mailto links with pre-filled subject & body.
+Templates are compiled once into segments and rendered in a single pass.
+"""
+import re
+import urllib.parse
+from functools import lru_cache
+
+from rapido import tracing
+
+_PLACEHOLDER = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+
+
+class CompiledTemplate:
+    """
+    Text parsed once into literal and variable segments. Rendering is a single
+    join over the segments; unknown placeholders are kept as-is and reported.
+    """
+    __slots__ = ("segments", "variables")
+
+    def __init__(self, text: str):
+        segments = []
+        pos = 0
+        for m in _PLACEHOLDER.finditer(text):
+            if m.start() > pos:
+                segments.append((False, text[pos:m.start()]))
+            segments.append((True, m.group(1)))
+            pos = m.end()
+        if pos < len(text):
+            segments.append((False, text[pos:]))
+        self.segments = tuple(segments)
+        self.variables = frozenset(name for is_var, name in segments if is_var)
+
+    def render(self, variables: dict):
+        """Returns (text, missing) – missing is the sorted list of unknown variables."""
+        out = []
+        missing = []
+        for is_var, value in self.segments:
+            if not is_var:
+                out.append(value)
+            elif value in variables:
+                out.append(str(variables[value]))
+            else:
+                out.append(f"{{{value}}}")
+                missing.append(value)
+        return "".join(out), sorted(set(missing))
+
+    def render_many(self, variable_sets):
+        """Render against many variable sets (mass mailing): list of (text, missing)."""
+        return [self.render(v) for v in variable_sets]
+
+
+@lru_cache(maxsize=512)
+def compile_template(text: str) -> CompiledTemplate:
+    return CompiledTemplate(text or "")
+
+
+def compile_email_template(email_template: dict):
+    """(subject, body) compiled for an email_templates row, cached by text (see compile_template)."""
+    return compile_template(email_template.get('subject') or ""), compile_template(email_template.get('body') or "")
+
+
+def _render_compiled(subject_tpl, body_tpl, variables):
+    subject, missing_subject = subject_tpl.render(variables)
+    body, missing_body = body_tpl.render(variables)
+    return {"subject": subject, "body": body, "missing": sorted(set(missing_subject) | set(missing_body))}
+
+
+@tracing.traced()
+def render_email(email_template: dict, variables: dict) -> dict:
+    """Render subject and body of an email_templates row: {"subject", "body", "missing"}."""
+    return _render_compiled(*compile_email_template(email_template), variables)
+
+
+@tracing.traced()
+def render_email_batch(email_template: dict, variable_sets) -> list:
+    """One email template against many variable sets; compiled once."""
+    subject_tpl, body_tpl = compile_email_template(email_template)
+    return [_render_compiled(subject_tpl, body_tpl, v) for v in variable_sets]
+
+
+def render_template(text: str, variables: dict) -> str:
+    """Replace {variable} placeholders in text with actual values."""
+    return compile_template(text).render(variables)[0]
+
+
+def build_template_variables(data: dict, template: dict) -> dict:
+    """Variables available in email templates, from an estimate and a visual template."""
+    # Mêmes totaux que sur le PDF joint (recalculés depuis les lignes, cf. generate_pdf)
+    from rapido.totals import with_computed_totals
+    data = with_computed_totals(data)
+    return {
+        "numero_devis": data.get('numero_devis', ''),
+        "date_devis": data.get('date_emission', ''),
+        "client_nom": data.get('client', {}).get('nom', ''),
+        "client_adresse": data.get('client', {}).get('adresse', ''),
+        "total_ht": f"{data.get('total_ht', 0):,.2f}".replace(',', ' ').replace('.', ','),
+        "total_ttc": f"{data.get('total_ttc', 0):,.2f}".replace(',', ' ').replace('.', ','),
+        "company_name": template.get('company_name', ''),
+    }
+
+
+def build_mailto_link(to_email: str, subject: str, body: str) -> str:
+    """
+    Build a mailto: URL with pre-filled subject and body.
+    Opens the user's default email client.
+    """
+    params = urllib.parse.urlencode({"subject": subject, "body": body}, quote_via=urllib.parse.quote)
+    return f"mailto:{to_email}?{params}"
@@ -0,0 +1,308 @@
+"""
+estimate_codec.py – Compact binary form of an estimate (the dict produced by
+extraction.extract_data_from_pdf and edited in the app), lossless both ways.
+
+    raw = estimate_codec.encode(data, compress=True)
+    estimate_codec.decode(raw) == data          # same keys, same order, same types
+
+Layout, little endian (version 1):
+
+    "RPDE"  version u8  flags u8                  (flags: 1 zlib body, 2 length-prefixed strings)
+    body:
+      counts     u32 x 5    strings, string bytes, nodes, sections, items
+      [lengths   u32 x strings]                   only with flag 2
+      strings    UTF-8, separated by NUL          string table (units, rates, keys... stored once)
+      kinds      u8 x nodes                       0 section, 1 item, 2 any other node
+      sections   u32 x sections                   text
+      items      u32 x 3 x items                  description, unite, details
+                 f64 x 4 x items                  quantite, prix_unitaire, tva_rate, total_ligne
+      values     tagged values: the estimate without its content (header, client,
+                 totals, tva_lines), then every node of kind 2
+
+Sections and items of the usual shape are stored column by column, so both
+directions run through a handful of struct calls. Anything else (edited items
+with int or None fields, extra keys) goes through the tagged encoding and
+comes back unchanged.
+"""
+import json
+import struct
+import zlib
+
+MAGIC = b"RPDE"
+VERSION = 1
+MEDIA_TYPE = "application/x-rapido-estimate"
+
+FLAG_ZLIB = 1
+FLAG_LENGTHS = 2
+
+# Taille maximale du corps décompressé (protège contre les « zip bombs »)
+MAX_DECODED_BYTES = 64 * 1024 * 1024
+
+SECTION, ITEM, OTHER = 0, 1, 2
+SECTION_KEYS = ('type', 'text')
+NODE_KEYS = ('type', 'data')
+ITEM_KEYS = ('description', 'quantite', 'unite', 'prix_unitaire', 'tva_rate', 'total_ligne', 'details')
+
+_PREFIX = struct.Struct("<4sBB")
+_COUNTS = struct.Struct("<5I")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+
+# Étiquettes des valeurs génériques
+_NONE, _TRUE, _FALSE, _INT, _FLOAT, _STR, _LIST, _DICT, _CONTENT, _JSON = b"NTFidslmcj"
+
+
+def _is_section(node):
+    return type(node) is dict and tuple(node) == SECTION_KEYS and node['type'] == 'section' \
+        and type(node['text']) is str
+
+
+def _is_item(node):
+    if type(node) is not dict or tuple(node) != NODE_KEYS or node['type'] != 'item':
+        return False
+    d = node['data']
+    return (type(d) is dict and tuple(d) == ITEM_KEYS
+            and type(d['description']) is str and type(d['unite']) is str and type(d['details']) is str
+            and type(d['quantite']) is float and type(d['prix_unitaire']) is float
+            and type(d['tva_rate']) is float and type(d['total_ligne']) is float)
+
+
+class _Encoder:
+    def __init__(self):
+        self.table = {}
+        self.values = bytearray()
+
+    def ref(self, text):
+        index = self.table.get(text)
+        if index is None:
+            index = self.table[text] = len(self.table)
+        return index
+
+    def value(self, v, content=False):
+        out = self.values
+        t = type(v)
+        if v is None:
+            out.append(_NONE)
+        elif t is bool:
+            out.append(_TRUE if v else _FALSE)
+        elif t is int and -2 ** 63 <= v < 2 ** 63:
+            out.append(_INT)
+            out += _I64.pack(v)
+        elif t is float:
+            out.append(_FLOAT)
+            out += _F64.pack(v)
+        elif t is str:
+            out.append(_STR)
+            out += _U32.pack(self.ref(v))
+        elif t is list:
+            out.append(_LIST)
+            out += _U32.pack(len(v))
+            for x in v:
+                self.value(x)
+        elif t is dict:
+            out.append(_DICT)
+            out += _U32.pack(len(v))
+            for k, x in v.items():
+                if type(k) is not str:
+                    raise TypeError(f"Keys must be str, not {type(k).__name__}")
+                out += _U32.pack(self.ref(k))
+                if content and k == 'content' and type(x) is list:
+                    # Contenu stocké en colonnes, à part
+                    out.append(_CONTENT)
+                else:
+                    self.value(x)
+        elif t is int:
+            # Entier hors 64 bits : gardé en texte
+            out.append(_JSON)
+            out += _U32.pack(self.ref(json.dumps(v)))
+        else:
+            raise TypeError(f"Object of type {t.__name__} cannot be encoded")
+
+
+def encode(data, compress=False, level=6):
+    """Estimate dict -> bytes. compress=True deflates the body (zlib)."""
+    enc = _Encoder()
+    ref = enc.ref
+    content = data.get('content') if type(data) is dict else None
+    if type(content) is not list:
+        content = []
+    kinds = bytearray(len(content))
+    section_refs, item_refs, item_nums, others = [], [], [], []
+    for i, node in enumerate(content):
+        if _is_item(node):
+            d = node['data']
+            kinds[i] = ITEM
+            item_refs += (ref(d['description']), ref(d['unite']), ref(d['details']))
+            item_nums += (d['quantite'], d['prix_unitaire'], d['tva_rate'], d['total_ligne'])
+        elif _is_section(node):
+            kinds[i] = SECTION
+            section_refs.append(ref(node['text']))
+        else:
+            kinds[i] = OTHER
+            others.append(node)
+
+    enc.value(data, content=True)
+    for node in others:
+        enc.value(node)
+
+    strings = list(enc.table)
+    flags = 0
+    lengths = b""
+    if any("\x00" in s for s in strings):
+        flags |= FLAG_LENGTHS
+        encoded = [s.encode("utf-8") for s in strings]
+        lengths = struct.pack(f"<{len(encoded)}I", *map(len, encoded))
+        blob = b"".join(encoded)
+    else:
+        blob = "\x00".join(strings).encode("utf-8")
+    n_items = len(item_nums) // 4
+    body = b"".join((
+        _COUNTS.pack(len(strings), len(blob), len(content), len(section_refs), n_items),
+        lengths,
+        blob,
+        bytes(kinds),
+        struct.pack(f"<{len(section_refs)}I", *section_refs),
+        struct.pack(f"<{len(item_refs)}I", *item_refs),
+        struct.pack(f"<{len(item_nums)}d", *item_nums),
+        enc.values,
+    ))
+    if compress:
+        flags |= FLAG_ZLIB
+        body = zlib.compress(body, level)
+    return _PREFIX.pack(MAGIC, VERSION, flags) + body
+
+
+def is_encoded(raw):
+    return raw[:4] == MAGIC
+
+
+class _Decoder:
+    def __init__(self, buf, pos, strings, content):
+        self.buf = buf
+        self.pos = pos
+        self.strings = strings
+        self.content = content
+
+    def value(self):
+        buf, strings = self.buf, self.strings
+        tag = buf[self.pos]
+        self.pos += 1
+        if tag == _STR:
+            (index,) = _U32.unpack_from(buf, self.pos)
+            self.pos += 4
+            return strings[index]
+        if tag == _FLOAT:
+            (v,) = _F64.unpack_from(buf, self.pos)
+            self.pos += 8
+            return v
+        if tag == _DICT:
+            (n,) = _U32.unpack_from(buf, self.pos)
+            self.pos += 4
+            out = {}
+            for _ in range(n):
+                (index,) = _U32.unpack_from(buf, self.pos)
+                self.pos += 4
+                out[strings[index]] = self.value()
+            return out
+        if tag == _LIST:
+            (n,) = _U32.unpack_from(buf, self.pos)
+            self.pos += 4
+            return [self.value() for _ in range(n)]
+        if tag == _INT:
+            (v,) = _I64.unpack_from(buf, self.pos)
+            self.pos += 8
+            return v
+        if tag == _NONE:
+            return None
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _CONTENT:
+            return self.content
+        if tag == _JSON:
+            (index,) = _U32.unpack_from(buf, self.pos)
+            self.pos += 4
+            return json.loads(strings[index])
+        raise ValueError(f"Corrupt estimate: unknown tag {tag!r} at {self.pos - 1}")
+
+
+def _inflate(body, max_size):
+    d = zlib.decompressobj()
+    try:
+        out = d.decompress(body, max_size)
+    except zlib.error as e:
+        raise ValueError(f"Corrupt estimate: {e}")
+    if d.unconsumed_tail:
+        raise ValueError(f"Binary estimate larger than {max_size} bytes once decompressed")
+    if not d.eof:
+        raise ValueError("Corrupt estimate: truncated zlib body")
+    return memoryview(out)
+
+
+def decode(raw, max_size=MAX_DECODED_BYTES):
+    """
+    bytes -> estimate dict. ValueError if `raw` is not an estimate of a known
+    version, is corrupt, or decompresses to more than max_size bytes.
+    """
+    if len(raw) < _PREFIX.size:
+        raise ValueError("Not a binary estimate (too short)")
+    magic, version, flags = _PREFIX.unpack_from(raw)
+    if magic != MAGIC:
+        raise ValueError("Not a binary estimate (bad magic)")
+    if version != VERSION:
+        raise ValueError(f"Unsupported binary estimate version {version} (expected {VERSION})")
+    body = memoryview(raw)[_PREFIX.size:]
+    if flags & FLAG_ZLIB:
+        body = _inflate(body, max_size)
+
+    try:
+        n_strings, blob_size, n_nodes, n_sections, n_items = _COUNTS.unpack_from(body)
+        pos = _COUNTS.size
+        if flags & FLAG_LENGTHS:
+            lengths = struct.unpack_from(f"<{n_strings}I", body, pos)
+            pos += 4 * n_strings
+            strings = []
+            for size in lengths:
+                strings.append(str(body[pos:pos + size], "utf-8"))
+                pos += size
+        else:
+            strings = str(body[pos:pos + blob_size], "utf-8").split("\x00") if n_strings else []
+            pos += blob_size
+        if len(strings) != n_strings:
+            raise ValueError("Corrupt estimate: string table size mismatch")
+        kinds = body[pos:pos + n_nodes]
+        pos += n_nodes
+        section_refs = struct.unpack_from(f"<{n_sections}I", body, pos)
+        pos += 4 * n_sections
+        item_refs = struct.unpack_from(f"<{3 * n_items}I", body, pos)
+        pos += 12 * n_items
+        nums = struct.unpack_from(f"<{4 * n_items}d", body, pos)
+        pos += 32 * n_items
+
+        s = strings
+        sections = [{'type': 'section', 'text': s[t]} for t in section_refs]
+        items = [
+            {'type': 'item', 'data': {'description': s[desc], 'quantite': q, 'unite': s[unite],
+                                      'prix_unitaire': pu, 'tva_rate': rate, 'total_ligne': total,
+                                      'details': s[details]}}
+            for desc, unite, details, q, pu, rate, total in zip(
+                item_refs[0::3], item_refs[1::3], item_refs[2::3], nums[0::4], nums[1::4], nums[2::4], nums[3::4])
+        ]
+
+        content = []
+        decoder = _Decoder(body, pos, strings, content)
+        data = decoder.value()
+        next_section, next_item = iter(sections).__next__, iter(items).__next__
+        for kind in kinds:
+            if kind == ITEM:
+                content.append(next_item())
+            elif kind == SECTION:
+                content.append(next_section())
+            else:
+                content.append(decoder.value())
+    except (struct.error, IndexError, StopIteration, RecursionError) as e:
+        # Index hors table, données tronquées, imbrication démesurée : 400 côté API, pas 500
+        raise ValueError(f"Corrupt estimate: {e}")
+    return data
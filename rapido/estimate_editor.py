@@ -0,0 +1,122 @@
+"""
+estimate_editor.py – Paginated row view of an estimate's content + diff application.
+Only the visible page is turned into rows; edits come back as small
+(index, field, value) changes applied in place to the in-memory estimate.
+"""
+
+PAGE_SIZE = 50
+
+# Colonnes éditables (ordre d'affichage dans le tableau)
+ITEM_FIELDS = ["description", "details", "quantite", "unite", "prix_unitaire", "tva_rate", "total_ligne"]
+NUMERIC_FIELDS = {"quantite", "prix_unitaire", "tva_rate", "total_ligne"}
+
+# Champs d'en-tête : (chemin dans le dict, libellé)
+HEADER_FIELDS = [
+    (("numero_devis",), "N° du devis"),
+    (("date_emission",), "Date"),
+    (("nom_projet",), "Nom du projet"),
+    (("client", "nom"), "Client"),
+    (("client", "adresse"), "Adresse client"),
+]
+TOTAL_FIELDS = [
+    (("total_ht",), "Total HT"),
+    (("tva",), "TVA"),
+    (("total_ttc",), "Total TTC"),
+]
+
+
+def page_count(content, page_size=PAGE_SIZE):
+    return max(1, (len(content) + page_size - 1) // page_size)
+
+
+def _to_cell(field, value):
+    # quantite vaut "" pour les items text-only : on l'affiche vide
+    if field in NUMERIC_FIELDS:
+        if value == "" or value is None:
+            return None
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    return value or ""
+
+
+def _from_cell(field, value, previous):
+    if field in NUMERIC_FIELDS:
+        if value is None or value == "":
+            return "" if previous == "" else 0.0
+        return float(value)
+    return "" if value is None else str(value)
+
+
+def node_to_row(index, node):
+    """One content node -> flat row for the table editor."""
+    if node['type'] == 'section':
+        row = {"index": index, "type": "section", "description": node.get('text', "")}
+        row.update({f: None if f in NUMERIC_FIELDS else "" for f in ITEM_FIELDS if f != "description"})
+        return row
+    d = node['data']
+    row = {"index": index, "type": "item"}
+    for f in ITEM_FIELDS:
+        row[f] = _to_cell(f, d.get(f))
+    return row
+
+
+def page_rows(content, page, page_size=PAGE_SIZE):
+    """Rows for the visible page only (page is 0-based)."""
+    start = page * page_size
+    return [node_to_row(i, content[i]) for i in range(start, min(start + page_size, len(content)))]
+
+
+def _clean(value):
+    # Le tableau renvoie NaN pour une cellule numérique vide
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def diff_rows(original_rows, edited_rows):
+    """Compare the rows sent to the editor with what came back -> list of (index, field, value)."""
+    changes = []
+    for orig, edited in zip(original_rows, edited_rows):
+        fields = ["description"] if orig["type"] == "section" else ITEM_FIELDS
+        for f in fields:
+            value = _clean(edited.get(f))
+            if value != orig.get(f):
+                changes.append((orig["index"], f, value))
+    return changes
+
+
+def apply_changes(data, changes):
+    """Apply (index, field, value) changes in place. Returns the number of changes applied."""
+    content = data.get('content', [])
+    applied = 0
+    for index, field, value in changes:
+        if not 0 <= index < len(content):
+            continue
+        node = content[index]
+        if node['type'] == 'section':
+            if field == "description":
+                node['text'] = "" if value is None else str(value)
+                applied += 1
+            continue
+        d = node['data']
+        new_value = _from_cell(field, value, d.get(field))
+        if d.get(field) != new_value:
+            d[field] = new_value
+            applied += 1
+    return applied
+
+
+def get_field(data, path):
+    value = data
+    for key in path:
+        value = (value or {}).get(key)
+    return value
+
+
+def set_field(data, path, value):
+    target = data
+    for key in path[:-1]:
+        target = target.setdefault(key, {})
+    target[path[-1]] = value
@@ -0,0 +1,191 @@
+"""
+jobs.py – Local background job queue for extraction and rendering.
+Bounded worker pool, global + per-user concurrency limits, bounded queue
+(admission control), cooperative cancellation and progress reporting.
+"""
+import contextvars
+import itertools
+import threading
+import time
+from collections import deque
+
+from rapido import tracing
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the queue (global or per-user) is saturated."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been cancelled (see Job.report / Job.check_cancelled)."""
+
+
+class Job:
+    def __init__(self, job_id, owner, kind, fn, args, kwargs):
+        self.id = job_id
+        self.owner = owner
+        self.kind = kind
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        # Contexte de l'appelant (trace de la session) : le job y est exécuté
+        self._context = contextvars.copy_context()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def report(self, progress, message=""):
+        """Called by the job function: progress in [0, 1]. Also a cancellation point."""
+        self.progress = max(0.0, min(1.0, float(progress)))
+        if message:
+            self.message = message
+        self.check_cancelled()
+
+
+class JobManager:
+    """
+    Worker threads pull the oldest queued job whose owner is under its
+    concurrency limit. Job functions are called as fn(job, *args, **kwargs).
+    """
+
+    def __init__(self, max_workers=4, per_user_limit=1, max_queued=64, max_queued_per_user=4, keep_finished=256):
+        self.max_workers = max_workers
+        self.per_user_limit = per_user_limit
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.keep_finished = keep_finished
+        self._ids = itertools.count(1)
+        self._queue = deque()
+        self._jobs = {}
+        self._finished = deque()
+        self._running_by_owner = {}
+        self._cond = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for w in self._workers:
+            w.start()
+
+    # --- API ---
+    def submit(self, owner, kind, fn, *args, **kwargs):
+        with self._cond:
+            if len(self._queue) >= self.max_queued:
+                raise QueueFull("File d'attente pleine, réessayez dans un instant.")
+            if sum(1 for j in self._queue if j.owner == owner) >= self.max_queued_per_user:
+                raise QueueFull("Trop de traitements en attente pour cette session.")
+            job = Job(f"{kind}-{next(self._ids)}", owner, kind, fn, args, kwargs)
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._cond.notify_all()
+            return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Queued jobs are dropped immediately; running jobs stop at their next report()."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job._cancel.set()
+            if job.status == QUEUED:
+                self._queue.remove(job)
+                self._finish(job, CANCELLED)
+            return True
+
+    def position(self, job_id):
+        """1-based position in the queue, 0 if not queued."""
+        with self._cond:
+            for i, j in enumerate(self._queue):
+                if j.id == job_id:
+                    return i + 1
+            return 0
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": len(self._queue),
+                "running": sum(self._running_by_owner.values()),
+                "workers": self.max_workers,
+            }
+
+    # --- Internals ---
+    def _next_runnable(self):
+        for job in self._queue:
+            if self._running_by_owner.get(job.owner, 0) < self.per_user_limit:
+                self._queue.remove(job)
+                return job
+        return None
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        job.fn = job.args = job.kwargs = None
+        job._context = None
+        self._finished.append(job.id)
+        while len(self._finished) > self.keep_finished:
+            self._jobs.pop(self._finished.popleft(), None)
+
+    @staticmethod
+    def _run_traced(job):
+        with tracing.span(f"job.{job.kind}", queued_ms=round((job.started_at - job.created_at) * 1000, 1)):
+            return job.fn(job, *job.args, **job.kwargs)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_runnable()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_runnable()
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._running_by_owner[job.owner] = self._running_by_owner.get(job.owner, 0) + 1
+
+            status = DONE
+            try:
+                job.result = job._context.run(self._run_traced, job)
+                if job.cancel_requested:
+                    status = CANCELLED
+            except JobCancelled:
+                status = CANCELLED
+            except Exception as e:
+                job.error = e
+                status = FAILED
+
+            with self._cond:
+                self._running_by_owner[job.owner] -= 1
+                if not self._running_by_owner[job.owner]:
+                    del self._running_by_owner[job.owner]
+                if status == DONE:
+                    job.progress = 1.0
+                self._finish(job, status)
+                # Un slot utilisateur s'est libéré : réveiller les workers en attente
+                self._cond.notify_all()
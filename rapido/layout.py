@@ -0,0 +1,99 @@
+"""
+layout.py – Pagination of the estimate body: memoised text measurements and
+look-ahead page breaks.
+
+Measuring a text (how many lines multi_cell will use) runs fpdf's line
+breaking, the most expensive step of a render. Line counts are memoised per
+process by (font, size, width, text): an unchanged line item is never measured
+twice.
+
+Page breaks are decided before anything is drawn, from the measured heights.
+Section titles are grouped with the item that follows them (a title is never
+left alone at the bottom of a page) and each group goes on the current page if
+it fits, else on the next one: one pass over the nodes, and for blocks that
+cannot be split this greedy filling gives the fewest pages.
+
+The plan records the layout state expected before each node (page, y,
+printing_items): when drawing diverges from it (fpdf split a block taller than
+a page), the rest of the document is planned again from the actual state.
+
+Nothing is carried over from one render to the next except the line counts:
+every render measures (from the memo) and draws all pages again. fpdf encodes
+text against a glyph subset built per document, so the drawn pages of a
+previous render cannot be reused in a new one.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+MEASURE_CACHE_SIZE = 50_000
+# Précision de comparaison des ordonnées (mm)
+Y_PRECISION = 3
+
+_measures = OrderedDict()
+_measures_lock = threading.Lock()
+
+Checkpoint = namedtuple("Checkpoint", "page y printing_items")
+# Ordonnée du haut du corps en page 1 et sur les pages suivantes, et seuil de saut de page (mm)
+PageGeometry = namedtuple("PageGeometry", "first_top top bottom")
+
+
+def checkpoint(pdf):
+    return Checkpoint(pdf.page_no(), round(pdf.get_y(), Y_PRECISION), pdf.printing_items)
+
+
+# --- Mesures ---
+def line_count(pdf, w, h, text):
+    """Number of lines multi_cell(w, h, text) takes with the current font (memoised)."""
+    key = (pdf.font_family, pdf.font_style, pdf.font_size_pt, w, text)
+    with _measures_lock:
+        if key in _measures:
+            _measures.move_to_end(key)
+            return _measures[key]
+    count = len(pdf.multi_cell(w, h, text, dry_run=True, output="LINES"))
+    with _measures_lock:
+        _measures[key] = count
+        while len(_measures) > MEASURE_CACHE_SIZE:
+            _measures.popitem(last=False)
+    return count
+
+
+# --- Plan ---
+def units(kinds, start=0):
+    """(first, end) ranges of nodes kept on the same page: section titles with the item that follows them."""
+    n = len(kinds)
+    first = start
+    while first < n:
+        last = first
+        while last < n - 1 and kinds[last] != 'item':
+            last += 1
+        yield first, last + 1
+        first = last + 1
+
+
+def plan(kinds, measure, geometry, state, start=0):
+    """
+    Page breaks of nodes[start:] from `state`: (checkpoints, breaks), one
+    entry per node, plus the final checkpoint. measure(index) gives (height,
+    advance) of a node: the height it needs on the page, and how far it moves
+    the cursor.
+    """
+    checkpoints = []
+    breaks = []
+    for first, end in units(kinds, start):
+        sizes = [measure(i) for i in range(first, end)]
+        need = sum(advance for _, advance in sizes[:-1]) + sizes[-1][0]
+        top = geometry.first_top if state.page == 1 else geometry.top
+        # Page vide : un groupe plus haut qu'une page y reste (fpdf le coupera)
+        page_break = state.y + need > geometry.bottom and state.y > top
+        checkpoints.append(state)
+        breaks.append(page_break)
+        y = geometry.top if page_break else state.y
+        page = state.page + 1 if page_break else state.page
+        for k, (_, advance) in enumerate(sizes):
+            if k:
+                checkpoints.append(Checkpoint(page, round(y, Y_PRECISION), state.printing_items))
+                breaks.append(False)
+            y += advance
+        state = Checkpoint(page, round(y, Y_PRECISION), state.printing_items)
+    checkpoints.append(state)
+    return checkpoints, breaks
@@ -0,0 +1,129 @@
+"""
+logos.py – Logo ingestion: content-hash deduplication, print and thumbnail renditions.
+Object names derive from the SHA-256 of the uploaded bytes, so variant URLs are
+known before processing and the upload itself can run in the background.
+Pillow is imported on first processing.
+"""
+import hashlib
+import io
+import mimetypes
+import os
+
+from rapido import tracing
+
+# PDF.header dessine le logo sur 22 mm de haut : 22 mm à 300 dpi ≈ 260 px
+PRINT_HEIGHT_PX = round(22 / 25.4 * 300)
+# Galerie : affiché sur 100 px de large, x2 pour les écrans haute densité
+THUMB_WIDTH_PX = 200
+
+
+def logo_hash(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def variant_paths(digest, file_name):
+    ext = (os.path.splitext(file_name)[1] or ".bin").lower()
+    return {
+        "original": f"{digest}/original{ext}",
+        "print": f"{digest}/print.png",
+        "thumb": f"{digest}/thumb.png",
+    }
+
+
+def _png(image):
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def make_renditions(file_bytes):
+    """Decode once, return (print_png, thumb_png). Never upscales."""
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(file_bytes))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() or image.mode == "P" else "RGB")
+
+    printable = image.copy()
+    if printable.height > PRINT_HEIGHT_PX:
+        printable.thumbnail((printable.width * PRINT_HEIGHT_PX // printable.height or 1, PRINT_HEIGHT_PX), Image.LANCZOS)
+
+    thumb = image.copy()
+    if thumb.width > THUMB_WIDTH_PX:
+        thumb.thumbnail((THUMB_WIDTH_PX, thumb.height * THUMB_WIDTH_PX // thumb.width or 1), Image.LANCZOS)
+
+    return _png(printable), _png(thumb)
+
+
+def logo_fields(storage, digest, file_name):
+    """Template columns pointing at every variant of a logo."""
+    paths = variant_paths(digest, file_name)
+    return {
+        "logo_url": storage.public_url(paths["original"]),
+        "logo_print_url": storage.public_url(paths["print"]),
+        "logo_thumb_url": storage.public_url(paths["thumb"]),
+    }
+
+
+@tracing.traced()
+def process_and_upload(storage, file_bytes, file_name, digest=None):
+    """Create renditions and upload every missing variant (identical logos are stored once)."""
+    digest = digest or logo_hash(file_bytes)
+    paths = variant_paths(digest, file_name)
+    # Le nom de l'original dépend de l'extension : mêmes octets en .jpeg après .jpg => nouvel original
+    missing = {name for name, path in paths.items() if not storage.exists(path)}
+    if not missing:
+        return paths
+    # Décodage avant tout envoi : une image illisible n'envoie rien
+    print_png, thumb_png = make_renditions(file_bytes)
+    content_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    uploads = {"original": (file_bytes, content_type), "print": (print_png, "image/png"),
+               "thumb": (thumb_png, "image/png")}
+    for name, (data, mime) in uploads.items():
+        if name in missing:
+            storage.upload(paths[name], data, mime)
+    return paths
+
+
+class SupabaseLogoStorage:
+    """Bucket access through a SupabasePool (timeouts, retries, latency stats)."""
+
+    def __init__(self, pool, bucket="logos"):
+        self._pool = pool
+        self._bucket = bucket
+        self._table = f"storage.{bucket}"
+
+    def exists(self, path):
+        folder, name = path.rsplit("/", 1)
+        files = self._pool.run(self._table, "list", lambda c: c.storage.from_(self._bucket).list(folder), idempotent=True)
+        return any(f.get("name") == name for f in files)
+
+    def upload(self, path, data, content_type):
+        # upsert : un envoi interrompu peut être rejoué sans erreur
+        self._pool.run(self._table, "upload", lambda c: c.storage.from_(self._bucket).upload(
+            path=path, file=data, file_options={"content-type": content_type, "upsert": "true"}))
+
+    def public_url(self, path):
+        with self._pool.client() as c:
+            return c.storage.from_(self._bucket).get_public_url(path)
+
+
+class LocalLogoStorage:
+    """Offline storage: files on disk, the local path is used as the URL."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def exists(self, path):
+        return os.path.exists(os.path.join(self.root, path))
+
+    def upload(self, path, data, content_type):
+        full = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(full + ".tmp", full)
+
+    def public_url(self, path):
+        return os.path.join(self.root, path)
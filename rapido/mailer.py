@@ -0,0 +1,250 @@
+"""
+mailer.py – Direct email delivery over SMTP with the estimate PDF attached.
+A small pool of SMTP connections (reused across messages), concurrent sending
+bounded by the pool size, a token-bucket rate limit, retries with backoff for
+transient failures (4xx, disconnects, timeouts) and a status record per message.
+
+Local stand-in for tests / demos (prints every message, no delivery):
+
+    python -m aiosmtpd -n -l localhost:1025      # then security="none", port=1025
+"""
+import contextvars
+import queue
+import random
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid, parseaddr
+
+from rapido import tracing
+
+SENT = "sent"
+FAILED = "failed"
+
+# Connexion inactive depuis plus longtemps : vérifiée par NOOP avant réutilisation
+KEEPALIVE_CHECK_SECONDS = 30
+
+
+def build_message(sender, to, subject, body, attachments=(), reply_to=None):
+    """
+    Plain-text email. attachments: iterable of (filename, bytes, mime type),
+    e.g. ("Estimation_D1.pdf", pdf_bytes, "application/pdf").
+    """
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg["Date"] = formatdate(localtime=True)
+    address = parseaddr(sender)[1]
+    msg["Message-ID"] = make_msgid(domain=address.rsplit("@", 1)[-1] if "@" in address else None)
+    if reply_to:
+        msg["Reply-To"] = reply_to
+    msg.set_content(body)
+    for filename, data, mime in attachments:
+        maintype, _, subtype = (mime or "application/octet-stream").partition("/")
+        msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
+    return msg
+
+
+def is_transient(error):
+    """Worth retrying: 4xx replies, dropped connections and network errors."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError))
+
+
+class RateLimiter:
+    """Token bucket: `rate` messages per `per` seconds, bursts up to `burst`."""
+
+    def __init__(self, rate, per=60.0, burst=1):
+        self.interval = per / rate if rate else 0.0
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) / self.interval)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * self.interval
+            time.sleep(wait)
+
+
+class _Connection:
+    __slots__ = ("smtp", "sent", "last_used")
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPMailer:
+    """
+    security: "starttls" (port 587), "ssl" (port 465) or "none" (local relay).
+    Connections are opened lazily, up to pool_size, and recycled after
+    max_messages_per_connection messages (many servers cap a session).
+    """
+
+    def __init__(self, host, port=587, username=None, password=None, sender=None, security="starttls",
+                 pool_size=4, timeout=30.0, rate_per_minute=120, retries=3, backoff=2.0,
+                 max_messages_per_connection=100):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender or username
+        if not self.sender:
+            raise ValueError("SMTPMailer needs a sender address (or a username to use as sender)")
+        self.security = security
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_messages_per_connection = max_messages_per_connection
+        self.rate_limiter = RateLimiter(rate_per_minute, per=60.0, burst=pool_size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._create_lock = threading.Lock()
+
+    # --- Connexions ---
+    def _connect(self):
+        if self.security == "ssl":
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.security == "starttls":
+                smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password or "")
+        return _Connection(smtp)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.smtp.quit()
+        except Exception:
+            conn.smtp.close()
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._create_lock:
+            self._created -= 1
+
+    def _alive(self, conn):
+        if time.monotonic() - conn.last_used < KEEPALIVE_CHECK_SECONDS:
+            return True
+        try:
+            return conn.smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection: reuse an idle one, open up to pool_size, otherwise wait."""
+        conn = None
+        while conn is None:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._create_lock:
+                    can_create = self._created < self.pool_size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        conn = self._connect()
+                    except Exception:
+                        with self._create_lock:
+                            self._created -= 1
+                        raise
+                else:
+                    conn = self._idle.get(timeout=self.timeout)
+            if not self._alive(conn):
+                self._discard(conn)
+                conn = None
+        try:
+            yield conn
+        except BaseException:
+            # État de la session SMTP inconnu après une erreur : on ne la réutilise pas
+            self._discard(conn)
+            raise
+        conn.last_used = time.monotonic()
+        if conn.sent >= self.max_messages_per_connection:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+    # --- Envoi ---
+    def message(self, to, subject, body, attachments=(), reply_to=None):
+        return build_message(self.sender, to, subject, body, attachments, reply_to)
+
+    @tracing.traced()
+    def send(self, msg, ref=None):
+        """
+        Send one message; never raises for delivery errors. Returns its status:
+        {"ref", "to", "subject", "message_id", "status", "attempts", "error", "sent_at"}.
+        """
+        status = {"ref": ref, "to": msg["To"], "subject": msg["Subject"], "message_id": msg["Message-ID"],
+                  "status": FAILED, "attempts": 0, "error": None, "sent_at": None}
+        for attempt in range(1 + self.retries):
+            self.rate_limiter.acquire()
+            status["attempts"] = attempt + 1
+            try:
+                with self.connection() as conn:
+                    conn.smtp.send_message(msg)
+                    conn.sent += 1
+                status["status"] = SENT
+                status["error"] = None
+                status["sent_at"] = datetime.now(timezone.utc).isoformat()
+                return status
+            except Exception as e:
+                status["error"] = f"{type(e).__name__}: {e}"
+                if not is_transient(e) or attempt == self.retries:
+                    return status
+                time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+        return status
+
+    def send_bulk(self, messages, progress=None):
+        """
+        messages: iterable of (ref, EmailMessage). Sent concurrently (pool_size
+        at a time, rate-limited). Returns the statuses in input order.
+        """
+        messages = list(messages)
+        statuses = [None] * len(messages)
+        with ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="smtp-send") as executor:
+            # Chaque envoi garde la trace de l'appelant
+            futures = {executor.submit(contextvars.copy_context().run, self.send, msg, ref): i
+                       for i, (ref, msg) in enumerate(messages)}
+            try:
+                for done, fut in enumerate(as_completed(futures), 1):
+                    statuses[futures[fut]] = fut.result()
+                    if progress:
+                        progress(done / len(messages), f"{done}/{len(messages)} emails envoyés")
+            except BaseException:
+                for fut in futures:
+                    fut.cancel()
+                raise
+        return statuses
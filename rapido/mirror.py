@@ -0,0 +1,303 @@
+"""
+mirror.py – Local SQLite mirror of the Supabase 'templates' and 'email_templates' tables.
+Reads are served from SQLite. Writes are applied locally, queued in an outbox
+and pushed to Supabase by a background sync thread, which then pulls the
+remote tables back. remote=None is a pure offline mode (no network at all).
+
+Conflicts: rows are identified by id (generated locally for new rows, so they
+keep it once pushed) and ordered by (created_at, id).
+- A pending local write wins over the remote copy until it has been pushed.
+- An update or delete whose row no longer exists remotely is dropped,
+  so remote deletes win.
+- A row missing remotely with no pending write is removed locally.
+
+Push errors are classified (is_permanent). Network and server errors are
+retried, outbox order preserved. A write the database rejects (constraint,
+unknown column...) would fail forever: it is moved to the dead_letters table
+and the sync goes on with the next ones; the remote copy of the row then
+wins at the next pull. Dead letters are listed to the user, who can retry
+(retry_dead_letter) or drop them (discard_dead_letter).
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+TABLES = ("templates", "email_templates")
+
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+
+# Codes SQLSTATE (préfixe de classe) et PostgREST d'une écriture refusée par la base : inutile de réessayer
+PERMANENT_CODES = ("22", "23", "42", "P0", "PGRST1", "PGRST2")
+# Statuts HTTP 4xx qui restent transitoires
+TRANSIENT_HTTP = (408, 425, 429)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def is_permanent(error):
+    """True when pushing the same write again cannot succeed; network and server errors are transient."""
+    code = getattr(error, "code", None)
+    if code is None:
+        # Erreur levée localement sur le contenu de l'écriture
+        return isinstance(error, (ValueError, TypeError, KeyError))
+    code = str(code)
+    if code.isdigit() and len(code) == 3:
+        status = int(code)
+        return 400 <= status < 500 and status not in TRANSIENT_HTTP
+    return code.startswith(PERMANENT_CODES)
+
+
+class LocalMirror:
+    def __init__(self, path=":memory:", remote=None):
+        self.remote = remote
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        for table in TABLES:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "id TEXT PRIMARY KEY, created_at TEXT NOT NULL, row TEXT NOT NULL)"
+            )
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_order ON {table} (created_at DESC, id DESC)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL, op TEXT NOT NULL, "
+            "row_id TEXT NOT NULL, payload TEXT, enqueued_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters ("
+            "seq INTEGER PRIMARY KEY, table_name TEXT NOT NULL, op TEXT NOT NULL, "
+            "row_id TEXT NOT NULL, payload TEXT, enqueued_at REAL NOT NULL, failed_at REAL NOT NULL, error TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._sync_thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self.last_sync = None
+        self.last_error = None
+
+    @property
+    def offline(self):
+        return self.remote is None
+
+    # --- Lectures ---
+    @staticmethod
+    def _project(row, columns):
+        if not columns:
+            return row
+        return {c: row.get(c) for c in columns}
+
+    def select(self, table, columns=None, limit=None, cursor=None, desc=True):
+        """Rows ordered by (created_at, id); keyset pagination with cursor=(created_at, id)."""
+        order = "DESC" if desc else "ASC"
+        sql, params = f"SELECT row FROM {table}", []
+        if cursor:
+            cmp = "<" if desc else ">"
+            sql += f" WHERE (created_at {cmp} ? OR (created_at = ? AND id {cmp} ?))"
+            params += [cursor[0], cursor[0], cursor[1]]
+        sql += f" ORDER BY created_at {order}, id {order}"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._project(json.loads(r[0]), columns) for r in rows]
+
+    def get(self, table, row_id, columns=None):
+        with self._lock:
+            r = self._conn.execute(f"SELECT row FROM {table} WHERE id = ?", (str(row_id),)).fetchone()
+        return self._project(json.loads(r[0]), columns) if r else None
+
+    # --- Écritures (locales + outbox) ---
+    def _store(self, table, row):
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {table} (id, created_at, row) VALUES (?, ?, ?)",
+            (str(row["id"]), row["created_at"], json.dumps(row, ensure_ascii=False)),
+        )
+
+    def _enqueue(self, table, op, row_id, payload=None):
+        self._conn.execute(
+            "INSERT INTO outbox (table_name, op, row_id, payload, enqueued_at) VALUES (?, ?, ?, ?, ?)",
+            (table, op, str(row_id), json.dumps(payload, ensure_ascii=False) if payload is not None else None, time.time()),
+        )
+
+    def upsert(self, table, fields, row_id=None):
+        """Insert (row_id=None and no id in fields) or merge fields into an existing row."""
+        return self.upsert_many(table, [dict(fields, id=row_id) if row_id else fields])[0]
+
+    def upsert_many(self, table, rows):
+        written = []
+        with self._lock:
+            for fields in rows:
+                existing = self.get(table, fields["id"]) if fields.get("id") else None
+                if existing:
+                    row = dict(existing, **fields)
+                    op = UPDATE
+                else:
+                    row = dict(fields)
+                    row.setdefault("id", str(uuid.uuid4()))
+                    row.setdefault("created_at", _now())
+                    op = INSERT
+                self._store(table, row)
+                if not self.offline:
+                    self._enqueue(table, op, row["id"], row if op == INSERT else fields)
+                written.append(row)
+            self._conn.commit()
+        self._wake.set()
+        return written
+
+    def delete(self, table, row_id):
+        with self._lock:
+            existing = self.get(table, row_id)
+            self._conn.execute(f"DELETE FROM {table} WHERE id = ?", (str(row_id),))
+            if existing and not self.offline:
+                self._enqueue(table, DELETE, row_id)
+            self._conn.commit()
+        self._wake.set()
+        return [existing] if existing else []
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    # --- Écritures refusées ---
+    def dead_letters(self):
+        """Writes rejected by the remote, oldest first: [{"seq", "table", "op", "row_id", "payload", "failed_at", "error"}]."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, table_name, op, row_id, payload, failed_at, error FROM dead_letters ORDER BY seq"
+            ).fetchall()
+        return [{"seq": seq, "table": table, "op": op, "row_id": row_id,
+                 "payload": json.loads(payload) if payload else None, "failed_at": failed_at, "error": error}
+                for seq, table, op, row_id, payload, failed_at, error in rows]
+
+    def discard_dead_letter(self, seq):
+        with self._lock:
+            self._conn.execute("DELETE FROM dead_letters WHERE seq = ?", (seq,))
+            self._conn.commit()
+
+    def retry_dead_letter(self, seq):
+        """Queue a rejected write again (at the end of the outbox) and re-apply it locally."""
+        with self._lock:
+            entry = self._conn.execute(
+                "SELECT table_name, op, row_id, payload FROM dead_letters WHERE seq = ?", (seq,)).fetchone()
+            if entry is None:
+                return
+            table, op, row_id, payload = entry
+            fields = json.loads(payload) if payload else None
+            # La ligne a pu être remplacée par la copie distante entre-temps
+            if op == INSERT:
+                self._store(table, fields)
+            elif op == UPDATE:
+                existing = self.get(table, row_id)
+                if existing:
+                    self._store(table, dict(existing, **fields))
+            else:
+                self._conn.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+            self._enqueue(table, op, row_id, fields)
+            self._conn.execute("DELETE FROM dead_letters WHERE seq = ?", (seq,))
+            self._conn.commit()
+        self._wake.set()
+
+    # --- Synchronisation ---
+    def sync_once(self):
+        """Push the outbox in order, then pull both tables. Raises on network errors."""
+        if self.offline:
+            return
+        self._push()
+        for table, rows in zip(TABLES, self._fetch_remote()):
+            self._pull(table, rows)
+        self.last_sync = time.time()
+        self.last_error = None
+
+    def _push(self):
+        while True:
+            with self._lock:
+                entry = self._conn.execute(
+                    "SELECT seq, table_name, op, row_id, payload FROM outbox ORDER BY seq LIMIT 1"
+                ).fetchone()
+            if entry is None:
+                return
+            seq, table, op, row_id, raw = entry
+            try:
+                payload = json.loads(raw) if raw else None
+                remote_table = self.remote.table(table)
+                if op == INSERT:
+                    remote_table.upsert(payload).execute()
+                elif op == UPDATE:
+                    data = {k: v for k, v in payload.items() if k not in ("id", "created_at")}
+                    # 0 ligne mise à jour = supprimée à distance : la suppression l'emporte
+                    remote_table.update(data).eq("id", row_id).execute()
+                else:
+                    remote_table.delete().eq("id", row_id).execute()
+            except Exception as e:
+                if not is_permanent(e):
+                    raise
+                # Écriture refusée : mise de côté, les suivantes (et le pull) continuent
+                with self._lock:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO dead_letters (seq, table_name, op, row_id, payload, enqueued_at, failed_at, error)"
+                        " SELECT seq, table_name, op, row_id, payload, enqueued_at, ?, ? FROM outbox WHERE seq = ?",
+                        (time.time(), str(e) or type(e).__name__, seq),
+                    )
+                    self._conn.execute("DELETE FROM outbox WHERE seq = ?", (seq,))
+                    self._conn.commit()
+                continue
+            with self._lock:
+                self._conn.execute("DELETE FROM outbox WHERE seq = ?", (seq,))
+                self._conn.commit()
+
+    def _fetch_remote(self):
+        """Remote rows of every table, fetched in parallel when the remote supports it."""
+        queries = [self.remote.table(table).select("*") for table in TABLES]
+        if hasattr(self.remote, "gather"):
+            responses = asyncio.run(self.remote.gather(*queries))
+        else:
+            responses = [q.execute() for q in queries]
+        return [r.data for r in responses]
+
+    def _pull(self, table, remote_rows):
+        with self._lock:
+            pending_ids = {r[0] for r in self._conn.execute(
+                "SELECT row_id FROM outbox WHERE table_name = ?", (table,))}
+            remote_ids = set()
+            for row in remote_rows:
+                remote_ids.add(str(row["id"]))
+                if str(row["id"]) not in pending_ids:
+                    self._store(table, row)
+            local_ids = {r[0] for r in self._conn.execute(f"SELECT id FROM {table}")}
+            for stale in local_ids - remote_ids - pending_ids:
+                self._conn.execute(f"DELETE FROM {table} WHERE id = ?", (stale,))
+            self._conn.commit()
+
+    def start_sync(self, interval=30.0):
+        """Background thread: sync every `interval` seconds, or right after a local write."""
+        if self.offline or self._sync_thread is not None:
+            return
+        def loop():
+            backoff = 1.0
+            while not self._stop.is_set():
+                try:
+                    self.sync_once()
+                    backoff = 1.0
+                    wait = interval
+                except Exception as e:
+                    self.last_error = str(e)
+                    wait = backoff
+                    backoff = min(backoff * 2, interval)
+                self._wake.wait(wait)
+                self._wake.clear()
+        self._sync_thread = threading.Thread(target=loop, name="mirror-sync", daemon=True)
+        self._sync_thread.start()
+
+    def stop_sync(self):
+        self._stop.set()
+        self._wake.set()
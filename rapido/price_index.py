@@ -0,0 +1,242 @@
+"""
+price_index.py – Searchable index of historical line items and their prices (SQLite).
+Descriptions are normalised (lower case, no accents, no numbering, no stop
+words) and tokenised. Every distinct (description, unit) gets an entry in an
+inverted index token -> entries, and every priced line extracted from a PDF
+is recorded against its entry. Price statistics per (description, unit) come
+from those occurrences.
+
+Updated incrementally by cas.extract_cached: an estimate is indexed once per
+source (the extraction key: PDF hash + extractor version), whichever process
+extracts it.
+
+    RAPIDO_PRICE_INDEX=/srv/rapido/prices.sqlite3   (opt-in: unset or "off" disables the index)
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+
+STOP_WORDS = frozenset(
+    "a au aux avec ce ces d de des du en et l la le les ou par pour sans sur un une y compris "
+    "dont selon type suivant yc".split()
+)
+_NUMBERING = re.compile(r"^\s*\d+(?:\.\d+)*\.?\s+")
+_TOKEN = re.compile(r"[a-z0-9]+")
+# Résultats de recherche gardés en mémoire (l'éditeur relance les mêmes à chaque rerun)
+LOOKUP_CACHE_SIZE = 4096
+
+
+def normalise(description):
+    """'1.2 Cloison placo BA13 (y compris bandes)' -> 'cloison placo ba13 bandes'."""
+    text = _NUMBERING.sub("", description or "")
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(t for t in _TOKEN.findall(text) if t not in STOP_WORDS and (len(t) > 1 or t.isdigit()))
+
+
+def tokens(description):
+    return sorted(set(normalise(description).split()))
+
+
+def _unit(unite):
+    return (unite or "").strip().lower().rstrip(".")
+
+
+class PriceIndex:
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            "  source TEXT PRIMARY KEY, numero TEXT, date TEXT, indexed_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "  id INTEGER PRIMARY KEY, norm TEXT NOT NULL, unite TEXT NOT NULL, description TEXT NOT NULL,"
+            "  ntokens INTEGER NOT NULL, UNIQUE (norm, unite));"
+            # ntokens recopié dans les postings : le classement ne lit que l'index inversé
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "  token TEXT NOT NULL, entry_id INTEGER NOT NULL, ntokens INTEGER NOT NULL,"
+            "  PRIMARY KEY (token, entry_id)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS occurrences ("
+            "  entry_id INTEGER NOT NULL, source TEXT NOT NULL, numero TEXT, date TEXT,"
+            "  quantite REAL, prix_unitaire REAL NOT NULL, tva_rate REAL);"
+            "CREATE INDEX IF NOT EXISTS occurrences_price ON occurrences (entry_id, prix_unitaire);"
+        )
+        self._conn.commit()
+        self._cache = OrderedDict()
+        self._data_version = None
+
+    # --- Mise à jour incrémentale ---
+    def has_source(self, source):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sources WHERE source = ?", (source,)).fetchone() is not None
+
+    def _entry_id(self, description, unite):
+        norm = normalise(description)
+        row = self._conn.execute("SELECT id FROM entries WHERE norm = ? AND unite = ?", (norm, unite)).fetchone()
+        if row:
+            return row[0]
+        toks = tokens(description)
+        entry_id = self._conn.execute(
+            "INSERT INTO entries (norm, unite, description, ntokens) VALUES (?, ?, ?, ?)",
+            (norm, unite, description.strip(), len(toks)),
+        ).lastrowid
+        self._conn.executemany("INSERT OR IGNORE INTO postings (token, entry_id, ntokens) VALUES (?, ?, ?)",
+                               [(t, entry_id, len(toks)) for t in toks])
+        return entry_id
+
+    def add_estimate(self, source, data):
+        """Index the priced lines of an extracted estimate. Returns the number of lines added (0 if already indexed)."""
+        numero = data.get('numero_devis')
+        date = data.get('date_emission')
+        added = 0
+        with self._lock:
+            if self.has_source(source):
+                return 0
+            try:
+                for node in data.get('content', []):
+                    if node.get('type') != 'item':
+                        continue
+                    d = node['data']
+                    pu = d.get('prix_unitaire')
+                    if not pu or not normalise(d.get('description')):
+                        continue
+                    entry_id = self._entry_id(d['description'], _unit(d.get('unite')))
+                    self._conn.execute(
+                        "INSERT INTO occurrences (entry_id, source, numero, date, quantite, prix_unitaire, tva_rate)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (entry_id, source, numero, date, d.get('quantite'), float(pu), d.get('tva_rate')),
+                    )
+                    added += 1
+                self._conn.execute("INSERT INTO sources (source, numero, date, indexed_at) VALUES (?, ?, ?, ?)",
+                                   (source, numero, date, time.time()))
+                self._conn.commit()
+                self._cache.clear()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return added
+
+    def backfill(self, store):
+        """Index every extraction already held by a cas.LocalFSStore. Returns the number of lines added."""
+        import json
+        from rapido.cas import EXTRACTIONS
+
+        added = 0
+        root = os.path.join(store.root, EXTRACTIONS)
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                if name.startswith(".tmp-") or self.has_source(name):
+                    continue
+                with open(os.path.join(dirpath, name), "rb") as f:
+                    added += self.add_estimate(name, json.loads(f.read()))
+        return added
+
+    # --- Recherche ---
+    def _stats(self, entry_id, exclude_numero):
+        where, params = "entry_id = ?", [entry_id]
+        if exclude_numero:
+            where += " AND (numero IS NULL OR numero != ?)"
+            params.append(exclude_numero)
+        count, lo, hi, mean = self._conn.execute(
+            f"SELECT COUNT(*), MIN(prix_unitaire), MAX(prix_unitaire), AVG(prix_unitaire) FROM occurrences WHERE {where}",
+            params).fetchone()
+        if not count:
+            return None
+        # Médiane : parcours de l'index (entry_id, prix_unitaire)
+        mids = [r[0] for r in self._conn.execute(
+            f"SELECT prix_unitaire FROM occurrences WHERE {where} ORDER BY prix_unitaire LIMIT ? OFFSET ?",
+            params + [2 - count % 2, (count - 1) // 2])]
+        last = self._conn.execute(
+            f"SELECT prix_unitaire, numero, date FROM occurrences WHERE {where} ORDER BY rowid DESC LIMIT 1",
+            params).fetchone()
+        return {
+            "count": count,
+            "min": round(lo, 2),
+            "median": round(sum(mids) / len(mids), 2),
+            "mean": round(mean, 2),
+            "max": round(hi, 2),
+            "last": round(last[0], 2),
+            "last_numero": last[1],
+            "last_date": last[2],
+        }
+
+    def lookup(self, description, unite=None, limit=5, exclude_numero=None):
+        """
+        Entries sharing the most tokens with `description`, best first, with
+        their price statistics. score = shared tokens / union of tokens;
+        entries with the same unit rank first at equal score.
+        exclude_numero leaves out the estimate being edited.
+        """
+        toks = tokens(description)
+        if not toks:
+            return []
+        unite = _unit(unite) if unite is not None else None
+        cache_key = (tuple(toks), unite, limit, exclude_numero)
+        marks = ",".join("?" * len(toks))
+        with self._lock:
+            # data_version change dès qu'une autre connexion (autre process) a écrit
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version:
+                self._cache.clear()
+                self._data_version = version
+            if cache_key in self._cache:
+                self._cache.move_to_end(cache_key)
+                return self._cache[cache_key]
+            ranked = self._conn.execute(
+                f"SELECT entry_id, ntokens, COUNT(*) AS shared FROM postings"
+                f" WHERE token IN ({marks}) GROUP BY entry_id"
+                f" ORDER BY shared * 1.0 / (ntokens + ? - shared) DESC LIMIT ?",
+                toks + [len(toks), limit * 8],
+            ).fetchall()
+            candidates = []
+            for entry_id, ntokens, shared in ranked:
+                desc, entry_unite = self._conn.execute(
+                    "SELECT description, unite FROM entries WHERE id = ?", (entry_id,)).fetchone()
+                candidates.append((entry_id, desc, entry_unite, ntokens, shared))
+            # À score égal, la même unité d'abord
+            candidates.sort(key=lambda c: (-c[4] / (c[3] + len(toks) - c[4]), c[2] != unite))
+            results = []
+            for entry_id, desc, entry_unite, ntokens, shared in candidates:
+                stats = self._stats(entry_id, exclude_numero)
+                if stats is None:
+                    continue
+                results.append(dict(stats, description=desc, unite=entry_unite,
+                                    score=round(shared / (ntokens + len(toks) - shared), 3)))
+                if len(results) == limit:
+                    break
+            self._cache[cache_key] = results
+            while len(self._cache) > LOOKUP_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return results
+
+    def best_match(self, description, unite=None, min_score=0.5, exclude_numero=None):
+        """Closest entry if it is similar enough, else None."""
+        matches = self.lookup(description, unite, limit=1, exclude_numero=exclude_numero)
+        return matches[0] if matches and matches[0]["score"] >= min_score else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sources": self._conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0],
+                "entries": self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0],
+                "lines": self._conn.execute("SELECT COUNT(*) FROM occurrences").fetchone()[0],
+            }
+
+
+@lru_cache(maxsize=None)
+def default_index():
+    """Index configured by RAPIDO_PRICE_INDEX (None when unset or disabled: nothing is written unless asked)."""
+    path = os.environ.get("RAPIDO_PRICE_INDEX", "")
+    if path.lower() in ("", "off", "none"):
+        return None
+    if path != ":memory:":
+        path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return PriceIndex(path)
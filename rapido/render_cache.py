@@ -0,0 +1,88 @@
+"""
+render_cache.py – Bounded in-memory cache of rendered PDFs.
+Keyed by a stable hash of the estimate, the template config and show_branding.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+def normalise_json(obj) -> str:
+    """Stable JSON text: sorted keys, no whitespace, unicode kept as-is."""
+    return json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def render_key(data: dict, config: dict) -> str:
+    """Hash identifying one render: same estimate + same template => same key."""
+    h = hashlib.sha256()
+    h.update(normalise_json(data).encode("utf-8"))
+    h.update(b"\x00")
+    h.update(normalise_json({k: v for k, v in config.items() if k != "show_branding"}).encode("utf-8"))
+    h.update(b"\x00")
+    h.update(b"1" if config.get("show_branding", True) else b"0")
+    return h.hexdigest()
+
+
+class RenderCache:
+    """LRU of PDF bytes, bounded by entry count and total size."""
+
+    def __init__(self, max_entries=32, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            pdf_bytes = self._entries.get(key)
+            if pdf_bytes is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return pdf_bytes
+
+    def contains(self, key):
+        """Presence test that does not count as a hit or a miss."""
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, pdf_bytes):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            # Un PDF plus gros que tout le cache n'est pas conservé
+            if len(pdf_bytes) > self.max_bytes:
+                return
+            self._entries[key] = pdf_bytes
+            self._size += len(pdf_bytes)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_or_render(self, data, config, render_fn):
+        """Return cached bytes for (data, config), rendering with render_fn(data, config) on a miss."""
+        key = render_key(data, config)
+        pdf_bytes = self.get(key)
+        if pdf_bytes is None:
+            pdf_bytes = render_fn(data, config)
+            self.put(key, pdf_bytes)
+        return pdf_bytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -0,0 +1,528 @@
+"""
+rendering.py – PDF rendering engine (FPDF).
+fpdf (and NumPy, for the totals) are only imported on the first render, so importing
+this module is cheap. Page breaks are decided on measured heights before
+drawing (see layout.py).
+"""
+import os
+import re
+from functools import lru_cache
+
+from rapido import layout, tracing
+
+# À incrémenter dès que le PDF produit change (invalide le store cas.py)
+RENDERER_VERSION = "3"
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fonts")
+# (famille, style, fichier) : lues une fois par process (cf. assets.add_font)
+FONTS = (
+    ("Arial", "", os.path.join(FONTS_DIR, "Arial.ttf")),
+    ("Arial", "B", os.path.join(FONTS_DIR, "Arial-Bold.ttf")),
+    ("Arial", "I", os.path.join(FONTS_DIR, "Arial.ttf")),
+)
+
+
+# --- Moteur de Template (FPDF) ---
+@lru_cache(maxsize=None)
+def get_pdf_class():
+    """Build the PDF class on first use (lazy fpdf import)."""
+    from fpdf import FPDF
+
+    class PDF(FPDF):
+        def __init__(self, color, logo_path=None, company_info=None, show_branding=True):
+            super().__init__()
+            self.primary_color = color # Tuple (R, G, B)
+            self.logo_path = logo_path
+            self.company_info = company_info or {}
+            self.printing_items = True # Flag: True = Print Table Header, False = Don't (for Totals pages)
+            self.show_branding = show_branding
+
+        def format_currency(self, value):
+            # Format: 1 234.56 € (with dot decimal as user requested previously, usually comma in FR)
+            # User request: "2340.00 devient 2 340.00"
+            return f"{value:,.2f}".replace(",", " ") + " €"
+            
+        def header(self):
+            # Only show branding on Page 1
+            if self.page_no() == 1:
+                # Couleur Dynamique
+                self.set_fill_color(*self.primary_color)
+                # self.rect(0, 0, 210, 20, 'F') # REMOVED BANNER
+                
+                # Logo (si présent)
+                if self.logo_path:
+                    try:
+                        # Increased Y (margin top) from 2 to 10
+                        # Increased Height (size) from 16 to 22
+                        self.image(self.logo_path, x=10, y=10, h=22)
+                    except Exception:
+                        pass
+                
+                # Infos Émetteur (Nom + Adresse sous le logo)
+                # On descend le texte pour ne pas chevaucher le logo agrandi
+                # Y=35 (Logo ends at 10+22=32)
+                self.set_y(35)
+                self.set_x(10)
+                self.set_font('Arial', 'B', 10)
+                self.set_text_color(50) # Gris foncé
+                
+                if self.company_info.get('name'):
+                    self.cell(0, 5, self.company_info['name'], ln=True)
+                    
+                self.set_font('Arial', size=9)
+                self.set_text_color(80) 
+                if self.company_info.get('address'):
+                     self.multi_cell(60, 4, self.company_info['address'])
+                     
+            # --- TABLE HEADER REPEATER ---
+            # Draw the table header on every page
+            # Y position depends on Page 1 or others
+            
+            if self.page_no() == 1:
+                y_header = 75
+            else:
+                y_header = 10 # Top margin for continuation pages
+                
+            # CONDITIONAL HEADER: Only show table columns if we are printing items
+            if self.printing_items:
+                self.set_y(y_header)
+                
+                # Primary Color BG, White Text, Bold
+                r, g, b = self.primary_color
+                self.set_fill_color(r, g, b)
+                self.set_text_color(255, 255, 255)
+                self.set_font("Arial", "B", 9)
+                
+                # Header AVEC fill
+                self.cell(10, 8, "N°", "B", 0, 'C', True)
+                self.cell(85, 8, "DÉSIGNATION", "B", 0, 'L', True)
+                self.cell(25, 8, "QTÉ", "B", 0, 'C', True)
+                self.cell(25, 8, "P.U HT", "B", 0, 'R', True)
+                self.cell(15, 8, "TVA", "B", 0, 'C', True)
+                self.cell(30, 8, "TOTAL HT", "B", 1, 'R', True)
+                
+                self.ln(8) # Move cursor down after header
+            
+                self.ln(8) # Move cursor down after header
+            
+            # Reset colors
+            self.set_text_color(0)
+            self.set_fill_color(0)
+            
+            # --- LOGO HANDLING (Remote vs Local) ---
+            # Note: self.image() normally handles URLs if libcurl is present,
+            # otherwise we might need to download it. For now, we assume local path OR valid URL.
+
+
+        def footer(self):
+            if self.show_branding:
+                self.set_y(-15)
+                self.set_font('Arial', 'I', 8)
+                self.set_text_color(128)
+                self.cell(0, 10, "Généré par Rapido'devis", 0, 0, 'C')
+
+    return PDF
+
+
+# --------------------------------------------------------------------------------
+# Helper: Tint Color
+# --------------------------------------------------------------------------------
+def get_tint(r, g, b, factor):
+    """Returns a lighter shade of the color. Factor 0-1 (1 is white)."""
+    return (
+        int(r + (255 - r) * factor),
+        int(g + (255 - g) * factor),
+        int(b + (255 - b) * factor)
+    )
+
+def template_config(template, show_branding=True):
+    """Template row (Supabase) -> config dict expected by generate_pdf."""
+    return {
+        "color": template['primary_color'],
+        # Rendition impression (22 mm) si disponible, sinon le fichier d'origine
+        "logo_path": template.get('logo_print_url') or template['logo_url'],
+        "company_name": template['company_name'],
+        "company_address": template['company_address'],
+        "show_branding": show_branding
+    }
+
+# --------------------------------------------------------------------------------
+# Pagination : hauteurs mesurées avant de dessiner (cf. layout.py)
+# --------------------------------------------------------------------------------
+BODY_TOP_FIRST = 85 # Page 1 : sous le cadre client
+BODY_TOP = 34 # Pages suivantes : sous l'en-tête de tableau répété (10 + 8 + 8 + 8)
+TOTALS_GAP = 5 # Espace entre le dernier article et le bloc des totaux
+
+DISCLAIMER = ("Ce document est une estimation et non un devis.\n"
+              "Ce document est généré automatiquement par un algorithme intelligent et "
+              "constitue une estimation indicative. Les montants indiqués sont susceptibles "
+              "d'être ajouté en cas de modification du taux de TVA en vigueur. Cette estimation "
+              "devra être confirmée par un artisan qualifié, qui établira un devis définitif prenant "
+              "en compte les spécificités de votre projet.")
+
+
+def split_number(description):
+    """'1.2 Cloison placo' -> ('1.2', 'Cloison placo'); ('', description) without numbering."""
+    match_num = re.match(r"^(\d+(?:\.\d+)*)\s+(.*)", description)
+    if match_num:
+        return match_num.group(1), match_num.group(2)
+    return "", description
+
+
+def is_text_only(d):
+    return d['total_ligne'] == 0.0 and d['prix_unitaire'] == 0.0
+
+
+def measure_node(pdf, node):
+    """(height, advance) of a content node as drawn by generate_pdf: space needed on the page, cursor move."""
+    if node['type'] == 'section':
+        return 10, 10 # ln(2) + cellule de 8
+    if node['type'] != 'item':
+        return 0, 0 # Autres nœuds : rien n'est dessiné
+    d = node['data']
+    text_only = is_text_only(d)
+    pdf.set_font("Arial", size=9)
+    height = layout.line_count(pdf, 180 if text_only else 85, 5, split_number(d['description'])[1]) * 5
+    if not text_only and d.get('details'):
+        pdf.set_font("Arial", size=8)
+        height += layout.line_count(pdf, 85, 4, d['details']) * 4
+    # Trait de séparation 1 mm sous l'article, puis 3 mm d'espace
+    return height + 1, height + 4
+
+
+def tva_lines_of(data):
+    tva_lines = data.get('tva_lines', [])
+    if not tva_lines and data.get('tva', 0) > 0:
+        # Fallback pour compatibilité si tva_lines n'est pas présent
+        tva_lines = [{"rate": "20.0", "amount": data['tva']}]
+    return tva_lines
+
+
+def totals_height(pdf, data):
+    """Height of the totals block: separator, disclaimer (left) beside the totals and the 'Net à payer' banner."""
+    pdf.set_font("Arial", size=8)
+    disclaimer_h = layout.line_count(pdf, 110, 3.5, DISCLAIMER) * 3.5
+    # ln(5) + HT + TVA x n + TTC + ln(4) + bandeau (texte jusqu'à +10)
+    totals_h = 5 + 6 + 6 * len(tva_lines_of(data)) + 6 + 4 + 10
+    return 2 + max(disclaimer_h, totals_h)
+
+
+@tracing.traced()
+def generate_pdf(data, config, progress=None):
+    # Totaux recalculés depuis les lignes : un JSON édité produit toujours des totaux justes
+    from rapido.totals import with_computed_totals
+    data = with_computed_totals(data)
+    
+    # Couleur et teintes (précalculées), fontes et logo décodés une fois par process (cf. assets.py)
+    from rapido import assets
+    colors = assets.palette(config.get('color', '#0056b3'))
+    r, g, b = colors["rgb"]
+    
+    # Infos émetteur
+    company_info = {
+        "name": config.get('company_name', ""),
+        "address": config.get('company_address', "")
+    }
+
+    pdf = get_pdf_class()(
+        color=(r, g, b), 
+        company_info=company_info,
+        show_branding=config.get('show_branding', True)
+    )
+    pdf.logo_path = assets.preload_logo(pdf, config.get('logo_path'))
+    # Fontes
+    for family, style, fname in FONTS:
+        assets.add_font(pdf, family, style, fname)
+    
+    pdf.add_page()
+    
+    # --- En-tête (Layout Fixe mais Data Dynamique) ---
+    pdf.set_font("Arial", "B", 16)
+    pdf.set_text_color(*(r, g, b)) 
+    # Position absolue pour ESTIMATION/DEVIS
+    pdf.set_xy(140, 10)
+    pdf.cell(60, 8, "ESTIMATION", align='R')
+    
+    pdf.set_font("Arial", size=10)
+    pdf.set_text_color(0)
+    
+    # Numéro
+    pdf.set_xy(140, 17)
+    pdf.cell(60, 5, f"N° {data['numero_devis']}", align='R')
+    
+    # Date
+    pdf.set_xy(140, 22)
+    pdf.cell(60, 5, f"En date du {data['date_emission']}", align='R')
+    
+    # Adresse Client (Position spécifique)
+    # Adresse Client (Position spécifique)
+    # Cadre Adresse: X=105, Y=30, W=95, H=40 (approx, ajuster selon contenu si besoin)
+    pdf.set_draw_color(0)
+    pdf.rect(105, 30, 95, 40)
+    
+    # Positionnement Contenu (Marge interne X=108, Y=33)
+    pdf.set_xy(108, 33)
+    
+    # Nom Client (Réduit à 11 Bold)
+    pdf.set_font("Arial", "B", 11)
+    pdf.cell(90, 6, data['client']['nom'], ln=True)
+    
+    # Adresse
+    pdf.set_font("Arial", size=10) # Réduit à 10
+    pdf.set_text_color(100, 116, 139) # Grayish
+    
+    addr_lines = data['client']['adresse'].split('\n')
+    is_chantier = False
+    
+    for line in addr_lines:
+        line = line.strip()
+        if not line: continue
+        
+        pdf.set_x(108) # Reset X inside box
+        
+        if "Adresse du chantier" in line:
+            is_chantier = True
+            pdf.ln(1) # Petit espace avant section chantier
+            pdf.set_x(108)
+            pdf.set_font("Arial", "B", 9)
+            pdf.set_text_color(0) # Black
+            pdf.cell(90, 5, line, ln=True)
+            
+            pdf.set_font("Arial", size=9)
+            pdf.set_text_color(100, 116, 139) 
+        else:
+            if is_chantier:
+                 pdf.set_font("Arial", size=9)
+            else:
+                 pdf.set_font("Arial", size=10)
+                 
+            pdf.set_text_color(100, 116, 139)
+            # Use MultiCell to ensure wrapping inside 90mm width
+            pdf.multi_cell(89, 4, line)
+            
+    pdf.set_text_color(0) # Reset black
+    
+    # NOUVEAU: Affichage du Nom du Projet juste au-dessus du tableau
+    if data.get('nom_projet'):
+        pdf.set_xy(10, 66)
+        pdf.set_font("Arial", "B", 11)
+        pdf.cell(90, 5, data['nom_projet'], ln=False)
+    
+    pdf.set_y(BODY_TOP_FIRST) # Ensure start Y (below header line 75 + 8 height + margin)
+    
+    # Pre-calc Tints
+    tint_lvl1, tint_lvl2 = colors["tints"] # Base Categories (1, 2, 3...) -> Darker / Sub Categories (1.1, 1.2...) -> Lighter
+    
+    # --- Content Loop ---
+    pdf.set_text_color(0)
+    
+    content = data.get('content', [])
+    
+    # --- Pagination (avant de dessiner) ---
+    # Sauts de page décidés sur les hauteurs mesurées : un titre de section reste avec son
+    # premier article
+    kinds = [node['type'] for node in content]
+    geometry = layout.PageGeometry(BODY_TOP_FIRST, BODY_TOP, pdf.page_break_trigger)
+    measure = lambda index: measure_node(pdf, content[index])
+    checkpoints, breaks = layout.plan(kinds, measure, geometry, layout.checkpoint(pdf))
+    replans = 0
+    
+    for index, item in enumerate(content):
+        if progress:
+            # Point d'annulation pour les jobs (cf. jobs.Job.report)
+            progress(0.1 + 0.8 * index / len(content), "Mise en page du PDF...")
+        state = layout.checkpoint(pdf)
+        if state != checkpoints[index]:
+            # fpdf a coupé un bloc plus haut qu'une page : on repagine la suite depuis l'état réel
+            tail = layout.plan(kinds, measure, geometry, state, start=index)
+            checkpoints[index:], breaks[index:] = tail
+            replans += 1
+        if breaks[index]:
+            pdf.add_page()
+        
+        # SECTION (Titre)
+        if item['type'] == 'section':
+             # Detect nesting level by counting dots in the first word (numbering)
+             # "1" -> 0 dots -> Level 1
+             # "1.1" -> 1 dot -> Level 2
+             
+             first_word = item['text'].split(' ')[0]
+             dots = first_word.count('.')
+             
+             if dots == 0:
+                 # Main Category (darker)
+                 pdf.set_fill_color(*tint_lvl1)
+             else:
+                 # Sub Category (lighter)
+                 pdf.set_fill_color(*tint_lvl2)
+             
+             pdf.ln(2) # Petit espace
+             pdf.set_font("Arial", "B", 10)
+             pdf.set_text_color(0) # Black Text as requested
+             # pdf.set_text_color(*(r, g, b)) # Old Branding color
+             
+             # Cell with Fill
+             pdf.cell(0, 8, item['text'], ln=True, fill=True)
+             
+             pdf.set_text_color(0)
+
+        # ITEM (Article)
+        elif item['type'] == 'item':
+            d = item['data']
+            text_only = is_text_only(d)
+            
+            # --- RENDERING ---
+            pdf.set_font("Arial", size=9) 
+            y_start = pdf.get_y()
+            
+            # Split Number / Description if possible for layout
+            num_text, desc_text = split_number(d['description'])
+
+            if text_only:
+                pdf.set_x(10)
+                pdf.cell(10, 5, num_text, 0, 0, 'C')
+                pdf.multi_cell(180, 5, desc_text)
+            else:
+                # Titre Article avec support multi-ligne
+                pdf.set_x(10)
+                # Colonne N° (On la garde fixe en haut de l'article)
+                pdf.cell(10, 5, num_text, 0, 0, 'C')
+                
+                # Description (Multi-ligne possible)
+                # On sauvegarde le Y pour aligner les colonnes de prix après
+                curr_y = pdf.get_y()
+                pdf.multi_cell(85, 5, desc_text)
+                end_y = pdf.get_y()
+                
+                # --- Colonnes de Chiffres (Alignées sur la première ligne de l'élément) ---
+                # On remonte au Y initial pour poser les chiffres à droite du titre
+                pdf.set_xy(105, curr_y) # 10 (marge) + 10 (N°) + 85 (Desc)
+                
+                # Quantité
+                val_q = d.get('quantite', 0)
+                try:
+                    vf = float(val_q)
+                    q_str = str(int(vf)) if vf.is_integer() else str(vf)
+                except:
+                    q_str = str(val_q)
+                
+                q_display = f"{q_str} {d['unite']}" if d.get('unite') else q_str
+                pdf.cell(25, 5, q_display, 0, 0, 'C')
+                
+                # P.U
+                pdf.cell(25, 5, pdf.format_currency(d['prix_unitaire']), 0, 0, 'R')
+                
+                # TVA
+                tva_disp = f"{d.get('tva_rate', 0):g}%"
+                pdf.cell(15, 5, tva_disp, 0, 0, 'C')
+                
+                # Total
+                pdf.cell(30, 5, pdf.format_currency(d['total_ligne']), 0, 1, 'R')
+                
+                # On se remet au maximum entre la fin de la description et la fin des prix
+                final_y = max(end_y, pdf.get_y())
+                pdf.set_y(final_y)
+
+            # 2. Détails (Texte gris)
+            if not text_only and d.get('details'):
+                pdf.set_font("Arial", size=8) 
+                pdf.set_text_color(80) 
+                pdf.set_x(20) 
+                pdf.multi_cell(85, 4, d['details'])
+                pdf.set_text_color(0) 
+            
+            # --- SEPARATOR LINE ---
+            # Après chaque item (standard ou text-only), on tire un trait gris fin
+            y_sep = pdf.get_y() + 1
+            pdf.set_draw_color(220, 220, 220) # Light Gray
+            pdf.line(10, y_sep, 200, y_sep)
+            pdf.set_draw_color(0) # Reset Black
+            pdf.set_y(y_sep + 1) # Move down slightly 
+            pdf.ln(2)
+
+    tracing.annotate(nodes=len(content), replans=replans)
+    
+    # --- Totaux ---
+    pdf.ln(TOTALS_GAP)
+    
+    # IMPORTANT: On arrête d'afficher l'en-tête (colonnes) pour la suite (Totaux)
+    # Cela garantit que si on change de page ici, la nouvelle page sera blanche (sans tableau)
+    pdf.printing_items = False
+    
+    # Bloc insécable (avertissement + totaux) : nouvelle page seulement s'il ne tient pas
+    if pdf.get_y() + totals_height(pdf, data) > pdf.page_break_trigger:
+        pdf.add_page()
+    
+    # Ligne séparation
+    pdf.line(10, pdf.get_y(), 200, pdf.get_y())
+    pdf.ln(2)
+    
+    # Save Y position
+    y_totals_start = pdf.get_y()
+    
+    # --- Disclaimer (Left) ---
+    pdf.set_xy(10, y_totals_start)
+    pdf.set_font("Arial", size=8)
+    pdf.set_text_color(100, 116, 139) # Gray
+    pdf.multi_cell(110, 3.5, DISCLAIMER)
+    
+    # --- Totals (Right) ---
+    pdf.set_y(y_totals_start)    
+    # --- New Styled Totals Block ---
+    pdf.ln(5)
+    
+    # Align Right for the text block
+    # Total net HT
+    pdf.set_font("Arial", size=10)
+    pdf.set_text_color(0)
+    pdf.cell(150, 6, "Total net HT", 0, 0, 'R')
+    pdf.cell(40, 6, f"{data['total_ht']:,.2f} €".replace(',', ' ').replace('.', ','), 0, 1, 'R')
+    
+    # TVA Lines
+    # Si on a plusieurs lignes de TVA, on les affiche toutes
+    for tva_item in tva_lines_of(data):
+        rate_val = tva_item['rate']
+        amt_val = tva_item['amount']
+        pdf.set_font("Arial", size=10)
+        pdf.cell(150, 6, f"TVA ({rate_val}%)", 0, 0, 'R')
+        pdf.cell(40, 6, f"{amt_val:,.2f} €".replace(',', ' ').replace('.', ','), 0, 1, 'R')
+    
+    # Total TTC
+    pdf.set_font("Arial", "B", 10)
+    pdf.cell(150, 6, "Total TTC", 0, 0, 'R')
+    pdf.cell(40, 6, f"{data['total_ttc']:,.2f} €".replace(',', ' ').replace('.', ','), 0, 1, 'R')
+    
+    pdf.ln(4)
+    
+    # --- "Net à payer" Banner ---
+    # Green/Primary Color Background
+    pdf.set_fill_color(*(r, g, b))
+    # White Text
+    pdf.set_text_color(255, 255, 255)
+    pdf.set_font("Arial", "B", 14)
+    
+    # Draw Background Rect manually or use Cell with Fill
+    # We want it full width (190mm) or partial right aligned? 
+    # User image shows Full Width or Wide Block. Let's make it full width standard.
+    
+    # Using Cell with Fill
+    # Label "Net à payer" Left aligned inside the block? Or visual spread?
+    # User image: "Net à payer" (Left part of green bar) .... "29 408,40 €" (Right part)
+    
+    y_banner = pdf.get_y()
+    pdf.rect(10, y_banner, 190, 12, 'F') # The green bar
+    
+    # Text inside
+    pdf.set_xy(15, y_banner + 2) # Padding left
+    pdf.cell(90, 8, "Net à payer", 0, 0, 'L')
+    
+    pdf.set_xy(105, y_banner + 2)
+    pdf.cell(90, 8, f"{data['total_ttc']:,.2f} €".replace(',', ' ').replace('.', ','), 0, 1, 'R')
+    
+    # Reset
+    pdf.set_text_color(0)
+    pdf.ln(15)
+    
+    if progress:
+        progress(0.9, "Écriture du PDF...")
+    return bytes(pdf.output())
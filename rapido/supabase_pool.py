@@ -0,0 +1,180 @@
+"""
+supabase_pool.py – Pooled, instrumented access to Supabase.
+A small pool of clients (each keeps its HTTP connections alive), per-call
+timeouts, bounded retries with jitter for idempotent reads, async variants
+for parallel fetches and a latency histogram per (table, operation).
+"""
+import asyncio
+import bisect
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Bornes des buckets de latence (ms) ; le dernier bucket est "au-delà"
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+READ_OPS = ("select", "list", "get_public_url", "download")
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.errors = 0
+
+    def record(self, ms, error=False):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.total += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        if error:
+            self.errors += 1
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (ms), capped at the max seen."""
+        if not self.total:
+            return 0.0
+        rank = p / 100 * self.total
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(float(BUCKETS_MS[i]), self.max_ms) if i < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def summary(self):
+        return {
+            "count": self.total,
+            "errors": self.errors,
+            "mean_ms": round(self.sum_ms / self.total, 1) if self.total else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+class _QueryRecorder:
+    """
+    Mimics the postgrest builder (table(...).select(...).eq(...)...). Calls are
+    recorded and replayed on a pooled client at execute() time.
+    """
+
+    def __init__(self, pool, table):
+        self._pool = pool
+        self._table = table
+        self._calls = []
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return self
+        return record
+
+    @property
+    def operation(self):
+        return self._calls[0][0] if self._calls else "select"
+
+    def _replay(self, client):
+        builder = client.table(self._table)
+        for name, args, kwargs in self._calls:
+            builder = getattr(builder, name)(*args, **kwargs)
+        return builder.execute()
+
+    def execute(self):
+        op = self.operation
+        return self._pool.run(self._table, op, self._replay, idempotent=op in READ_OPS)
+
+    async def aexecute(self):
+        return await asyncio.to_thread(self.execute)
+
+
+class SupabasePool:
+    def __init__(self, url, key, size=4, timeout=10.0, storage_timeout=30.0, retries=2, backoff=0.2):
+        self.url = url
+        self.key = key
+        self.size = size
+        self.timeout = timeout
+        self.storage_timeout = storage_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._create_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._histograms = {}
+
+    def _new_client(self):
+        from supabase import ClientOptions, create_client
+        options = ClientOptions(postgrest_client_timeout=self.timeout, storage_client_timeout=self.storage_timeout)
+        return create_client(self.url, self.key, options=options)
+
+    @contextmanager
+    def client(self):
+        """Borrow a client: reuse an idle one, create up to `size`, otherwise wait."""
+        try:
+            c = self._idle.get_nowait()
+        except queue.Empty:
+            with self._create_lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    c = self._new_client()
+                except Exception:
+                    with self._create_lock:
+                        self._created -= 1
+                    raise
+            else:
+                c = self._idle.get(timeout=self.timeout)
+        try:
+            yield c
+        finally:
+            self._idle.put(c)
+
+    def _record(self, table, op, ms, error):
+        with self._stats_lock:
+            self._histograms.setdefault((table, op), LatencyHistogram()).record(ms, error)
+
+    def run(self, table, op, fn, idempotent=False):
+        """
+        Run fn(client) with timing. Idempotent calls are retried up to `retries`
+        times with exponential backoff and full jitter.
+        """
+        attempts = 1 + (self.retries if idempotent else 0)
+        for attempt in range(attempts):
+            start = time.perf_counter()
+            try:
+                with self.client() as c:
+                    result = fn(c)
+                self._record(table, op, (time.perf_counter() - start) * 1000, False)
+                return result
+            except Exception:
+                self._record(table, op, (time.perf_counter() - start) * 1000, True)
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    async def arun(self, table, op, fn, idempotent=False):
+        return await asyncio.to_thread(self.run, table, op, fn, idempotent)
+
+    # --- Même interface que le client supabase pour les requêtes de table ---
+    def table(self, name):
+        return _QueryRecorder(self, name)
+
+    async def gather(self, *queries):
+        """Execute several table queries in parallel: await pool.gather(q1, q2)."""
+        return await asyncio.gather(*(q.aexecute() for q in queries))
+
+    def latency_report(self):
+        with self._stats_lock:
+            return [
+                {"table": table, "operation": op, **h.summary()}
+                for (table, op), h in sorted(self._histograms.items())
+            ]
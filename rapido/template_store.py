@@ -0,0 +1,32 @@
+"""
+template_store.py – Read access to visual templates for headless callers (HTTP API, scripts).
+Configuration is explicit; supabase is only imported by SupabaseTemplateStore.
+"""
+
+
+class InMemoryTemplateStore:
+    """Stand-in store for local runs and tests: templates given as a list of rows."""
+
+    def __init__(self, templates=None):
+        self._templates = {str(t['id']): dict(t) for t in (templates or [])}
+
+    def get(self, template_id):
+        t = self._templates.get(str(template_id))
+        return dict(t) if t else None
+
+    def add(self, template):
+        self._templates[str(template['id'])] = dict(template)
+
+
+class SupabaseTemplateStore:
+    """Reads the 'templates' table directly, without Streamlit or st.secrets."""
+
+    COLUMNS = "id,name,company_name,company_address,primary_color,logo_url,logo_print_url,logo_thumb_url,emails"
+
+    def __init__(self, url, key):
+        from supabase import create_client
+        self._client = create_client(url, key)
+
+    def get(self, template_id):
+        response = self._client.table("templates").select(self.COLUMNS).eq("id", template_id).limit(1).execute()
+        return response.data[0] if response.data else None
@@ -0,0 +1,105 @@
+"""
+totals.py – Totals and TVA computed from the line items (NumPy).
+One vectorised pass over `content`: HT, TVA per rate, TTC, and the lines whose
+quantite × prix_unitaire does not match total_ligne.
+
+TVA is computed per rate on the HT base of that rate, rounded to the cent
+(half away from zero), as on a French invoice.
+"""
+import math
+
+import numpy as np
+
+# Écart toléré entre quantite × prix_unitaire (arrondi au centime) et total_ligne
+LINE_TOLERANCE = 0.01
+
+
+def _num(value):
+    if value is None or value == "":
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def round_cents(values):
+    """Round to the cent, half away from zero (np.round rounds half to even)."""
+    values = np.asarray(values, dtype=float)
+    return np.sign(values) * np.floor(np.abs(values) * 100 + 0.5 + 1e-9) / 100
+
+
+def line_arrays(content):
+    """Item lines as arrays: index (in content), quantite, prix_unitaire, tva_rate, total_ligne (NaN if absent)."""
+    items = [(i, n['data']) for i, n in enumerate(content) if n.get('type') == 'item']
+    n = len(items)
+    return {
+        "index": np.fromiter((i for i, _ in items), dtype=np.int64, count=n),
+        "quantite": np.fromiter((_num(d.get('quantite')) for _, d in items), dtype=float, count=n),
+        "prix_unitaire": np.fromiter((_num(d.get('prix_unitaire')) for _, d in items), dtype=float, count=n),
+        "tva_rate": np.fromiter((_num(d.get('tva_rate')) for _, d in items), dtype=float, count=n),
+        "total_ligne": np.fromiter((_num(d.get('total_ligne')) for _, d in items), dtype=float, count=n),
+    }
+
+
+def format_rate(rate):
+    # Même forme que les lignes extraites du PDF fournisseur : "20.0", "5.5"
+    return f"{rate:.1f}" if float(rate).is_integer() else f"{rate:g}"
+
+
+def compute_totals(content, tolerance=LINE_TOLERANCE):
+    """
+    {"total_ht", "tva", "tva_lines": [{"rate", "base", "amount"}], "total_ttc",
+     "priced_lines", "mismatches": [{"index", "expected", "total_ligne"}]}
+    """
+    a = line_arrays(content)
+    totals = np.nan_to_num(a["total_ligne"])
+    rates = np.nan_to_num(a["tva_rate"])
+    priced = totals != 0
+
+    # Bases HT par taux : un seul passage (unique + bincount)
+    unique_rates, inverse = np.unique(rates[priced], return_inverse=True)
+    bases = round_cents(np.bincount(inverse, weights=totals[priced], minlength=len(unique_rates)))
+    amounts = round_cents(bases * unique_rates / 100)
+
+    total_ht = float(round_cents(totals.sum()))
+    tva = float(round_cents(amounts.sum()))
+
+    # Lignes incohérentes : quantité et PU renseignés, produit ≠ total de la ligne
+    q, pu = a["quantite"], a["prix_unitaire"]
+    expected = round_cents(np.nan_to_num(q * pu))
+    checkable = ~np.isnan(q) & ~np.isnan(pu) & (np.nan_to_num(pu) != 0)
+    bad = checkable & (np.abs(expected - totals) > tolerance + 1e-9)
+
+    return {
+        "total_ht": total_ht,
+        "tva": tva,
+        "tva_lines": [
+            {"rate": format_rate(r), "base": float(b), "amount": float(m)}
+            for r, b, m in zip(unique_rates.tolist(), bases.tolist(), amounts.tolist())
+            if r != 0
+        ],
+        "total_ttc": float(round_cents(total_ht + tva)),
+        "priced_lines": int(priced.sum()),
+        "mismatches": [
+            {"index": int(i), "expected": float(e), "total_ligne": float(t)}
+            for i, e, t in zip(a["index"][bad].tolist(), expected[bad].tolist(), totals[bad].tolist())
+        ],
+    }
+
+
+def with_computed_totals(data):
+    """
+    Copy of the estimate whose totals come from its lines. Estimates without
+    priced lines keep their extracted totals.
+    """
+    computed = compute_totals(data.get('content', []))
+    if not computed["priced_lines"]:
+        return data
+    return dict(
+        data,
+        total_ht=computed["total_ht"],
+        tva=computed["tva"],
+        tva_lines=[{"rate": l["rate"], "amount": l["amount"]} for l in computed["tva_lines"]],
+        total_ttc=computed["total_ttc"],
+    )
@@ -0,0 +1,250 @@
+"""
+tracing.py – Lightweight span tracing: per-session trace ids, nested spans,
+export to a rotating JSONL file and per-operation p50/p95 summaries.
+
+    with tracing.span("db.get_templates"):
+        ...
+
+    @tracing.traced()                       # span "rapido.rendering.generate_pdf"
+    def generate_pdf(...): ...
+
+One JSON line per finished span:
+    {"trace_id", "span_id", "parent_id", "name", "start", "duration_ms", "status", "error", "attrs"}
+
+    RAPIDO_TRACE_PATH=/var/log/rapido/spans.jsonl   (unset or "off": no file, spans kept in memory only)
+
+The current trace and span live in contextvars: background jobs inherit them
+(see jobs.JobManager.submit). Process workers write their own spans to the
+same file without a trace id.
+"""
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+_trace_id = contextvars.ContextVar("rapido_trace_id", default=None)
+_current_span = contextvars.ContextVar("rapido_span", default=None)
+
+# Derniers spans en mémoire (page d'administration sans relire le fichier)
+RECENT_SPANS = 5000
+_recent = deque(maxlen=RECENT_SPANS)
+_exporter_lock = threading.Lock()
+_exporter = None
+
+
+class JSONLExporter:
+    """Appends spans to a JSONL file, rotated at max_bytes (backups kept: path.1 ... path.N)."""
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=5):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._logger = logging.getLogger(f"rapido.tracing.{path}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if not self._logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    def export(self, record):
+        self._logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def files(self):
+        """Current file and its backups, oldest first."""
+        handler = self._logger.handlers[0]
+        backups = [f"{self.path}.{i}" for i in range(handler.backupCount, 0, -1)]
+        return [p for p in backups + [self.path] if os.path.exists(p)]
+
+
+def get_exporter():
+    """Exporter configured by RAPIDO_TRACE_PATH (None when unset or disabled: the library writes no file unless asked)."""
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            path = os.environ.get("RAPIDO_TRACE_PATH", "")
+            _exporter = False if path.lower() in ("", "off", "none") else JSONLExporter(os.path.abspath(path))
+        return _exporter or None
+
+
+def set_exporter(exporter):
+    global _exporter
+    with _exporter_lock:
+        _exporter = exporter or False
+
+
+# --- Traces et spans ---
+def set_trace(trace_id):
+    """Attach the current context (a Streamlit session, a request...) to a trace id."""
+    _trace_id.set(trace_id)
+
+
+def current_trace():
+    return _trace_id.get()
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "trace_id", "attrs", "start", "_t0")
+
+    def __init__(self, name, attrs):
+        parent = _current_span.get()
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = _trace_id.get()
+        self.attrs = attrs
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self, error=None):
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round((time.perf_counter() - self._t0) * 1000, 3),
+            "status": "error" if error else "ok",
+            "error": f"{type(error).__name__}: {error}" if error else None,
+            "attrs": self.attrs,
+        }
+        _recent.append(record)
+        exporter = get_exporter()
+        if exporter:
+            try:
+                exporter.export(record)
+            except Exception:
+                # Le traçage ne doit jamais faire échouer l'opération tracée
+                pass
+        return record
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time the enclosed block as a child of the current span. Only Exception
+    marks the span as failed: control-flow exceptions (st.rerun, st.stop,
+    KeyboardInterrupt) derive from BaseException and end it normally.
+    """
+    s = Span(name, attrs)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except Exception as e:
+        s.finish(error=e)
+        raise
+    except BaseException:
+        s.finish()
+        raise
+    else:
+        s.finish()
+    finally:
+        _current_span.reset(token)
+
+
+def annotate(**attrs):
+    """Add attributes to the current span (no-op outside a span)."""
+    s = _current_span.get()
+    if s is not None:
+        s.set(**attrs)
+
+
+def traced(name=None):
+    """Decorator: run the function inside a span (default name: module.function)."""
+    def decorator(fn):
+        span_name = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- Lecture et agrégation ---
+def recent_spans():
+    return list(_recent)
+
+
+def read_spans(since=None, exporter=None):
+    """Spans from the exported files (all processes and sessions), optionally since a timestamp."""
+    exporter = exporter or get_exporter()
+    if not exporter:
+        return recent_spans()
+    spans = []
+    for path in exporter.files():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if since is None or record["start"] >= since:
+                    spans.append(record)
+    return spans
+
+
+def _percentile(sorted_values, p):
+    # Rang le plus proche : valeur effectivement observée
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+def summarize(spans):
+    """Per-operation stats sorted by total time: count, errors, p50/p95/max and total (ms)."""
+    by_name = {}
+    errors = {}
+    for s in spans:
+        by_name.setdefault(s["name"], []).append(s["duration_ms"])
+        if s["status"] == "error":
+            errors[s["name"]] = errors.get(s["name"], 0) + 1
+    rows = []
+    for name, durations in by_name.items():
+        durations.sort()
+        rows.append({
+            "operation": name,
+            "count": len(durations),
+            "errors": errors.get(name, 0),
+            "p50_ms": round(_percentile(durations, 50), 1),
+            "p95_ms": round(_percentile(durations, 95), 1),
+            "max_ms": round(durations[-1], 1),
+            "total_ms": round(sum(durations), 1),
+        })
+    rows.sort(key=lambda r: r["total_ms"], reverse=True)
+    return rows
+
+
+def slowest_traces(spans, limit=20, root_name=None):
+    """Root spans (no parent) with the longest duration, optionally of a given name."""
+    roots = [s for s in spans if s["parent_id"] is None and (root_name is None or s["name"] == root_name)]
+    return sorted(roots, key=lambda s: s["duration_ms"], reverse=True)[:limit]
+
+
+def trace_spans(spans, trace_id, root_span_id):
+    """Every span under a root span, depth-first, as (depth, span)."""
+    children = {}
+    for s in spans:
+        if s["trace_id"] == trace_id:
+            children.setdefault(s["parent_id"], []).append(s)
+    out = []
+
+    def walk(parent_id, depth):
+        for s in sorted(children.get(parent_id, []), key=lambda s: s["start"]):
+            out.append((depth, s))
+            walk(s["span_id"], depth + 1)
+    root = next((s for s in children.get(None, []) if s["span_id"] == root_span_id), None)
+    if root:
+        out.append((0, root))
+        walk(root_span_id, 1)
+    return out
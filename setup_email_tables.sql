@@ -26,3 +26,31 @@ with check (true);
 -- Stores contact emails associated with a visual template (company identity)
 alter table public.templates
   add column if not exists emails text[] default '{}';
+
+-- 3. Update time of email templates (cache key of compiled templates)
+alter table public.email_templates
+  add column if not exists updated_at timestamp with time zone default timezone('utc'::text, now());
+
+-- 4. Delivery log of emails sent over SMTP (one row per message)
+create table if not exists public.email_deliveries (
+  id uuid default gen_random_uuid() primary key,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  reference text,               -- e.g. file name or estimate number
+  "to" text not null,
+  subject text,
+  message_id text,
+  status text not null,         -- 'sent' | 'failed'
+  attempts integer not null default 1,
+  error text,
+  sent_at timestamp with time zone
+);
+
+alter table public.email_deliveries enable row level security;
+
+create policy "Enable access for all users"
+on "public"."email_deliveries"
+as PERMISSIVE
+for ALL
+to public
+using (true)
+with check (true);
@@ -0,0 +1,8 @@
+-- ============================================================
+-- Logo variants: print rendition (PDF header) + dashboard thumbnail
+-- ============================================================
+
+-- logo_url keeps the original upload; objects are stored under <sha256>/ in the 'logos' bucket
+alter table public.templates
+  add column if not exists logo_print_url text,
+  add column if not exists logo_thumb_url text;
@@ -0,0 +1,35 @@
+import io
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SAMPLE_PDFS = ("ESTIMATION N° D202601-1078.pdf", "estimationdebase.pdf")
+
+
+@pytest.fixture(autouse=True)
+def no_disk_store(monkeypatch):
+    # Pas de store disque partagé (~/.cache) pendant les tests
+    monkeypatch.setenv("RAPIDO_STORE_DIR", "off")
+
+
+@pytest.fixture(scope="session")
+def sample_estimates():
+    """Estimates extracted from the sample PDFs at the repository root."""
+    from rapido.extraction import extract_data_from_pdf
+    estimates = []
+    for name in SAMPLE_PDFS:
+        with open(os.path.join(ROOT, name), "rb") as f:
+            estimates.append(extract_data_from_pdf(io.BytesIO(f.read())))
+    return estimates
+
+
+@pytest.fixture
+def logo_file(tmp_path):
+    from PIL import Image
+    path = tmp_path / "logo.png"
+    Image.new("RGB", (240, 120), (0, 86, 179)).save(path)
+    return str(path)
@@ -0,0 +1,74 @@
+import asyncio
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pdfplumber
+
+import api
+from rapido.template_store import InMemoryTemplateStore
+
+TEMPLATE = {"id": "t1", "primary_color": "#0056b3", "logo_url": None,
+            "company_name": "ACME", "company_address": "1 rue de la Paix"}
+
+
+class SlowTemplateStore(InMemoryTemplateStore):
+    def get(self, template_id):
+        time.sleep(0.5)
+        return super().get(template_id)
+
+
+def _app(store=None):
+    return api.RapidoAPI(store or InMemoryTemplateStore([TEMPLATE]), executor=ThreadPoolExecutor(2))
+
+
+async def _call(app, method, path, body=b"", headers=()):
+    sent = []
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "http", "method": method, "path": path, "headers": list(headers), "query_string": b""},
+              receive, send)
+    return sent[0]["status"], b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def _render_body(data, **options):
+    return json.dumps(dict({"estimate": data, "template_id": "t1"}, **options)).encode()
+
+
+def test_malformed_content_length_is_rejected(sample_estimates):
+    status, body = asyncio.run(_call(_app(), "POST", "/render", _render_body(sample_estimates[0]),
+                                     [(b"content-length", b"12abc")]))
+    assert status == 400
+
+
+def test_show_branding_string_values(sample_estimates):
+    app = _app()
+    status, pdf_bytes = asyncio.run(_call(app, "POST", "/render", _render_body(sample_estimates[0], show_branding="false")))
+    assert status == 200
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        assert "Rapido'devis" not in pdf.pages[0].extract_text()
+    status, _ = asyncio.run(_call(app, "POST", "/render", _render_body(sample_estimates[0], show_branding="maybe")))
+    assert status == 400
+
+
+def test_template_lookup_does_not_block_the_event_loop(sample_estimates):
+    app = _app(SlowTemplateStore([TEMPLATE]))
+
+    async def scenario():
+        start = time.monotonic()
+        render = asyncio.create_task(_call(app, "POST", "/render", _render_body(sample_estimates[0])))
+        await asyncio.sleep(0.05)
+        status, _ = await _call(app, "GET", "/health")
+        elapsed = time.monotonic() - start
+        assert (await render)[0] == 200
+        return status, elapsed
+
+    status, elapsed = asyncio.run(scenario())
+    assert status == 200 and elapsed < 0.25
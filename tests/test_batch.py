@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from rapido import batch, mailer
+
+
+class FakeMailer:
+    def __init__(self):
+        self.sent = []
+
+    def message(self, to, subject, body, attachments=()):
+        return mailer.build_message("devis@example.com", to, subject, body, attachments)
+
+    def send_bulk(self, messages, progress=None):
+        statuses = []
+        for ref, msg in messages:
+            self.sent.append(ref)
+            statuses.append({"ref": ref, "to": msg["To"], "subject": msg["Subject"], "message_id": msg["Message-ID"],
+                             "status": mailer.SENT, "attempts": 1, "error": None, "sent_at": "now"})
+        return statuses
+
+
+def test_email_all_sends_the_rest_when_a_render_fails(sample_estimates):
+    broken = dict(sample_estimates[1])
+    del broken['client']
+    results = [{"name": "a.pdf", "data": sample_estimates[0], "error": None},
+               {"name": "b.pdf", "data": broken, "error": None},
+               {"name": "c.pdf", "data": sample_estimates[1], "error": None}]
+    recipients = {"a.pdf": "a@example.com", "b.pdf": "b@example.com", "c.pdf": "c@example.com"}
+    smtp = FakeMailer()
+    with ThreadPoolExecutor(2) as executor:
+        statuses = batch.email_all(executor, smtp, results, {"color": "#0056b3"},
+                                   {"subject": "Devis {numero_devis}", "body": "Bonjour"}, {}, recipients)
+    assert [s['ref'] for s in statuses] == ["a.pdf", "b.pdf", "c.pdf"]
+    assert [s['status'] for s in statuses] == [mailer.SENT, mailer.FAILED, mailer.SENT]
+    assert statuses[1]['to'] == "b@example.com" and statuses[1]['attempts'] == 0 and statuses[1]['error']
+    assert smtp.sent == ["a.pdf", "c.pdf"]
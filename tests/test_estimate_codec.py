@@ -0,0 +1,70 @@
+import copy
+import struct
+import zlib
+
+import pytest
+
+from rapido import estimate_codec
+
+
+def _edited(data):
+    # Lignes éditées dans l'app : entiers, None, clés en plus, nœuds inconnus
+    data = copy.deepcopy(data)
+    items = [n for n in data['content'] if n['type'] == 'item']
+    items[0]['data']['quantite'] = 3
+    items[0]['data']['prix_unitaire'] = None
+    items[1]['data']['remise'] = 0.1
+    items[2]['data']['details'] = "ligne\x00avec NUL"
+    data['content'].append({"type": "note", "text": "interne", "tags": [1, 2 ** 70, True, None]})
+    data['client']['email'] = None
+    return data
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip_sample_estimates(sample_estimates, compress):
+    for data in sample_estimates + [_edited(d) for d in sample_estimates]:
+        decoded = estimate_codec.decode(estimate_codec.encode(data, compress=compress))
+        assert decoded == data
+        # Mêmes types et même ordre des clés que l'original
+        assert repr(decoded) == repr(data)
+
+
+def test_decode_rejects_truncated_input(sample_estimates):
+    for compress in (False, True):
+        raw = estimate_codec.encode(_edited(sample_estimates[0]), compress=compress)
+        for end in range(0, len(raw) - 1, 7):
+            with pytest.raises(ValueError):
+                estimate_codec.decode(raw[:end])
+
+
+def test_decode_rejects_bad_magic_and_version(sample_estimates):
+    raw = estimate_codec.encode(sample_estimates[0])
+    with pytest.raises(ValueError, match="magic"):
+        estimate_codec.decode(b"XXXX" + raw[4:])
+    with pytest.raises(ValueError, match="version"):
+        estimate_codec.decode(raw[:4] + bytes([estimate_codec.VERSION + 1]) + raw[5:])
+
+
+def test_decode_rejects_corrupt_string_references(sample_estimates):
+    raw = bytearray(estimate_codec.encode(sample_estimates[0]))
+    n_strings, blob_size, n_nodes, n_sections, _ = struct.unpack_from("<5I", raw, 6)
+    assert n_sections
+    # Première référence de section (après compteurs, table et types) hors de la table
+    struct.pack_into("<I", raw, 6 + 20 + blob_size + n_nodes, n_strings + 5)
+    with pytest.raises(ValueError, match="Corrupt"):
+        estimate_codec.decode(bytes(raw))
+
+
+def test_decode_rejects_corrupt_zlib_body():
+    header = estimate_codec._PREFIX.pack(estimate_codec.MAGIC, estimate_codec.VERSION, estimate_codec.FLAG_ZLIB)
+    with pytest.raises(ValueError, match="Corrupt"):
+        estimate_codec.decode(header + b"not zlib at all")
+    with pytest.raises(ValueError, match="truncated"):
+        estimate_codec.decode(header + zlib.compress(b"\x00" * 100)[:-3])
+
+
+def test_decode_rejects_oversized_zlib_body():
+    header = estimate_codec._PREFIX.pack(estimate_codec.MAGIC, estimate_codec.VERSION, estimate_codec.FLAG_ZLIB)
+    bomb = header + zlib.compress(b"\x00" * (2 * 1024 * 1024), 9)
+    with pytest.raises(ValueError, match="larger than"):
+        estimate_codec.decode(bomb, max_size=1024 * 1024)
@@ -0,0 +1,49 @@
+import io
+
+import pdfplumber
+
+from rapido.rendering import generate_pdf
+
+
+def _config(logo_path):
+    return {"color": "#0056b3", "logo_path": logo_path, "company_name": "ACME",
+            "company_address": "1 rue de la Paix\n75002 Paris", "show_branding": True}
+
+
+def test_consecutive_renders_share_fonts_and_logo(sample_estimates, logo_file):
+    # Fontes et logo décodés une fois par process (assets.py) : chaque document garde son propre état
+    data = sample_estimates[0]
+    first = generate_pdf(data, _config(logo_file))
+    second = generate_pdf(data, _config(logo_file))
+    texts = []
+    for pdf_bytes in (first, second):
+        assert pdf_bytes.startswith(b"%PDF-")
+        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+            assert len(pdf.pages[0].images) == 1
+            assert all(not page.images for page in pdf.pages[1:])
+            texts.append([page.extract_text() for page in pdf.pages])
+    assert "ESTIMATION" in texts[0][0] and data['numero_devis'] in texts[0][0]
+    assert texts[0] == texts[1]
+
+
+def test_unreachable_logo_renders_without_it(sample_estimates, tmp_path):
+    pdf_bytes = generate_pdf(sample_estimates[0], _config(str(tmp_path / "missing.png")))
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        assert not pdf.pages[0].images
+
+
+def test_public_fpdf_fallback(sample_estimates, logo_file, monkeypatch):
+    from rapido import assets
+    monkeypatch.setattr(assets, "fpdf_internals_supported", lambda: False)
+    pdf_bytes = generate_pdf(sample_estimates[0], _config(logo_file))
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        assert len(pdf.pages[0].images) == 1
+
+
+def test_unknown_nodes_are_skipped(sample_estimates):
+    data = dict(sample_estimates[0])
+    data['content'] = [{"type": "note", "text": "interne"}] + data['content'] + [{"type": "note"}]
+    expected = generate_pdf(sample_estimates[0], _config(None))
+    with pdfplumber.open(io.BytesIO(generate_pdf(data, _config(None)))) as pdf, \
+            pdfplumber.open(io.BytesIO(expected)) as ref:
+        assert [p.extract_text() for p in pdf.pages] == [p.extract_text() for p in ref.pages]
@@ -1,4 +1,4 @@
-from app import extract_data_from_pdf
+from rapido.extraction import extract_data_from_pdf
 import os
 
 pdf_path = "/Users/communication2/Desktop/RapidoPython/estimationdebase.pdf"